@@ -0,0 +1,210 @@
+import os
+import time
+import threading
+from collections import Counter, OrderedDict
+
+from backend.geo import haversine_m
+
+ACCEPT = "accept"
+MERGE = "merge"  # redundant point, superseded by the last accepted one
+DROP = "drop"  # agent is over its rate budget
+
+LOCATION_RATE = float(os.getenv("LOCATION_RATE", "1.0"))  # sustained pings/second per agent
+LOCATION_BURST = float(os.getenv("LOCATION_BURST", "5"))  # token bucket capacity
+LOCATION_MIN_INTERVAL_SECONDS = float(os.getenv("LOCATION_MIN_INTERVAL_SECONDS", "1.0"))
+LOCATION_MIN_DISTANCE_M = float(os.getenv("LOCATION_MIN_DISTANCE_M", "5.0"))
+# A stationary agent still gets a point written this often, so "last seen" stays fresh
+LOCATION_MAX_INTERVAL_SECONDS = float(os.getenv("LOCATION_MAX_INTERVAL_SECONDS", "60"))
+LOCATION_STATE_TTL_SECONDS = int(os.getenv("LOCATION_STATE_TTL_SECONDS", "3600"))
+LOCATION_OFFENDERS_MAX = 10000  # agents ranked for the stats' top list in Redis; the least rejected fall off
+
+
+class LocationAdmission:
+    """
+    In-process per-agent admission policy for location pings.
+
+    A point is merged (not written) when it arrives sooner than the minimum
+    interval, or is closer than the minimum distance to the agent's last
+    accepted point and the max interval hasn't passed yet. Otherwise it must
+    take a token from the agent's bucket, and is dropped if the bucket is
+    empty. State is local to the worker; use RedisLocationAdmission when
+    running several workers.
+
+    An agent's state and counts are forgotten once it has sent nothing for
+    ttl seconds, as the Redis keys expire, so memory follows the active fleet.
+    """
+
+    def __init__(self, rate=LOCATION_RATE, burst=LOCATION_BURST,
+                 min_interval=LOCATION_MIN_INTERVAL_SECONDS, min_distance=LOCATION_MIN_DISTANCE_M,
+                 max_interval=LOCATION_MAX_INTERVAL_SECONDS, ttl=LOCATION_STATE_TTL_SECONDS):
+        self.rate = rate
+        self.burst = burst
+        self.min_interval = min_interval
+        self.min_distance = min_distance
+        self.max_interval = max_interval
+        self.ttl = ttl
+        # agent_id -> [tokens, refilled_at, last_lat, last_lon, last_accepted_at],
+        # least recently pinged first so expired agents are popped off the front
+        self._state = OrderedDict()
+        self._counts = Counter()
+        self._agent_counts = {}
+        self._lock = threading.Lock()
+
+    async def admit(self, agent_id, latitude, longitude):
+        return self.check(agent_id, latitude, longitude)
+
+    def check(self, agent_id, latitude, longitude, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._expire(now)
+            state = self._state.get(agent_id)
+            if state is None:
+                state = [self.burst, now, None, None, None]
+                self._state[agent_id] = state
+            else:
+                self._state.move_to_end(agent_id)
+            state[0] = min(self.burst, state[0] + (now - state[1]) * self.rate)
+            state[1] = now
+
+            since_last = None if state[4] is None else now - state[4]
+            if since_last is not None and (
+                since_last < self.min_interval
+                or (since_last < self.max_interval
+                    and haversine_m(state[2], state[3], latitude, longitude) < self.min_distance)
+            ):
+                decision = MERGE
+            elif state[0] < 1:
+                decision = DROP
+            else:
+                state[0] -= 1
+                state[2], state[3], state[4] = latitude, longitude, now
+                decision = ACCEPT
+
+            self._counts[decision] += 1
+            self._agent_counts.setdefault(agent_id, Counter())[decision] += 1
+        return decision
+
+    def _expire(self, now):
+        while self._state:
+            agent_id, state = next(iter(self._state.items()))
+            if now - state[1] < self.ttl:
+                break
+            del self._state[agent_id]
+            self._agent_counts.pop(agent_id, None)
+
+    async def stats(self, top=10):
+        with self._lock:
+            self._expire(time.monotonic())
+            offenders = sorted(
+                self._agent_counts.items(),
+                key=lambda item: item[1][MERGE] + item[1][DROP],
+                reverse=True,
+            )[:top]
+            return {
+                "backend": "memory",
+                "accepted": self._counts[ACCEPT],
+                "merged": self._counts[MERGE],
+                "dropped": self._counts[DROP],
+                "top_agents": [
+                    {"agent_id": agent_id, "accepted": c[ACCEPT], "merged": c[MERGE], "dropped": c[DROP]}
+                    for agent_id, c in offenders
+                ],
+            }
+
+
+# Same policy as LocationAdmission, evaluated atomically inside Redis so
+# every worker shares one bucket per agent. Distance uses an equirectangular
+# approximation, which is accurate well beyond the few meters we compare.
+_ADMIT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local lat = tonumber(ARGV[2])
+local lon = tonumber(ARGV[3])
+local rate = tonumber(ARGV[4])
+local burst = tonumber(ARGV[5])
+local min_interval = tonumber(ARGV[6])
+local min_distance = tonumber(ARGV[7])
+local max_interval = tonumber(ARGV[8])
+local ttl = tonumber(ARGV[9])
+local offenders_max = tonumber(ARGV[11])
+
+local s = redis.call('HMGET', KEYS[1], 'tokens', 'refilled_at', 'lat', 'lon', 'accepted_at')
+if not s[2] then
+    -- New or expired state: its rank restarts with its counts
+    redis.call('ZREM', KEYS[3], ARGV[10])
+end
+local tokens = tonumber(s[1]) or burst
+local refilled_at = tonumber(s[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - refilled_at) * rate)
+
+local decision = 'accept'
+if s[5] then
+    local rad = math.pi / 180
+    local x = (lon - tonumber(s[4])) * rad * math.cos((lat + tonumber(s[3])) / 2 * rad)
+    local y = (lat - tonumber(s[3])) * rad
+    local dist = math.sqrt(x * x + y * y) * 6371000
+    local since_last = now - tonumber(s[5])
+    if since_last < min_interval or (since_last < max_interval and dist < min_distance) then
+        decision = 'merge'
+    end
+end
+if decision == 'accept' and tokens < 1 then
+    decision = 'drop'
+end
+
+if decision == 'accept' then
+    tokens = tokens - 1
+    redis.call('HSET', KEYS[1], 'lat', lat, 'lon', lon, 'accepted_at', now)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'refilled_at', now)
+redis.call('HINCRBY', KEYS[1], 'count_' .. decision, 1)
+redis.call('EXPIRE', KEYS[1], ttl)
+redis.call('HINCRBY', KEYS[2], decision, 1)
+redis.call('ZINCRBY', KEYS[3], decision == 'accept' and 0 or 1, ARGV[10])
+if redis.call('ZCARD', KEYS[3]) > offenders_max then
+    redis.call('ZREMRANGEBYRANK', KEYS[3], 0, -offenders_max - 1)
+end
+return decision
+"""
+
+
+class RedisLocationAdmission:
+    """Admission policy with per-agent state shared across workers through Redis"""
+
+    def __init__(self, redis_pool, rate=LOCATION_RATE, burst=LOCATION_BURST,
+                 min_interval=LOCATION_MIN_INTERVAL_SECONDS, min_distance=LOCATION_MIN_DISTANCE_M,
+                 max_interval=LOCATION_MAX_INTERVAL_SECONDS, ttl=LOCATION_STATE_TTL_SECONDS):
+        self.redis = redis_pool
+        self.args = [rate, burst, min_interval, min_distance, max_interval, ttl]
+        self._script = redis_pool.register_script(_ADMIT_SCRIPT)
+
+    async def admit(self, agent_id, latitude, longitude):
+        keys = [
+            f"location_admission:agent:{agent_id}",
+            "location_admission:stats",
+            "location_admission:offenders",
+        ]
+        return await self._script(keys=keys, args=[time.time(), latitude, longitude, *self.args, agent_id, LOCATION_OFFENDERS_MAX])
+
+    async def stats(self, top=10):
+        counts = await self.redis.hgetall("location_admission:stats")
+        offenders = await self.redis.zrevrange("location_admission:offenders", 0, top - 1)
+        pipe = self.redis.pipeline()
+        for agent_id in offenders:
+            pipe.hmget(f"location_admission:agent:{int(agent_id)}", f"count_{ACCEPT}", f"count_{MERGE}", f"count_{DROP}")
+        top_agents, expired = [], []
+        for agent_id, agent_counts in zip(offenders, await pipe.execute()):
+            if agent_counts[0] is None and agent_counts[1] is None and agent_counts[2] is None:
+                # State expired with the agent's silence; forget it here too
+                expired.append(agent_id)
+                continue
+            accepted, merged, dropped = (int(count or 0) for count in agent_counts)
+            top_agents.append({"agent_id": int(agent_id), "accepted": accepted, "merged": merged, "dropped": dropped})
+        if expired:
+            await self.redis.zrem("location_admission:offenders", *expired)
+        return {
+            "backend": "redis",
+            "accepted": int(counts.get(ACCEPT, 0)),
+            "merged": int(counts.get(MERGE, 0)),
+            "dropped": int(counts.get(DROP, 0)),
+            "top_agents": top_agents,
+        }
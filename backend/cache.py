@@ -0,0 +1,205 @@
+import json
+import os
+import time
+import uuid
+
+READ_CACHE_TTL_SECONDS = int(os.getenv("READ_CACHE_TTL_SECONDS", "300"))
+# Vehicle rows carry current_latitude/longitude, which move with every
+# location ping. Those pings don't invalidate the cache (live positions go out
+# as location_update events), so vehicle lists only live this long.
+READ_CACHE_VEHICLES_TTL_SECONDS = int(os.getenv("READ_CACHE_VEHICLES_TTL_SECONDS", "10"))
+
+# Which cached collections each ops_events event makes stale
+EVENT_TAGS = {
+    "user_signup": ["users"],
+    "user_role_updated": ["users", "agents"],
+    "user_deleted": ["users", "agents"],
+    "vehicle_registered": ["vehicles"],
+    "vehicle_approved": ["vehicles"],
+    "vehicle_agent_assigned": ["vehicles"],
+    "order_status": ["vehicles"],  # picking up / delivering flips vehicle.status
+}
+
+
+# Which list endpoints' collection versions (ETags) each event changes
+EVENT_COLLECTIONS = {
+    "order_created": ["orders"],
+    "order_status": ["orders", "vehicles"],
+    "location_update": ["locations"],
+    "vehicle_registered": ["vehicles"],
+    "vehicle_approved": ["vehicles"],
+    "vehicle_agent_assigned": ["vehicles"],
+}
+
+
+def event_tags(event: dict):
+    """Cache tags invalidated by an event, including the owner->agent membership entry"""
+    tags = list(EVENT_TAGS.get(event.get("event"), []))
+    if event.get("event") == "user_signup" and event.get("role") == "agent":
+        # Signing up straight into the agent role adds to the agent list
+        tags.append("agents")
+    if event.get("owner_id"):
+        # Only creation with an agent and (re)assignment change an owner's agent set
+        created_with_agent = event.get("event") == "order_created" and event.get("assigned_agent_id")
+        reassigned = (
+            event.get("event") == "order_status"
+            and "old_agent_id" in event
+            and event["old_agent_id"] != event.get("assigned_agent_id")
+        )
+        if created_with_agent or reassigned:
+            tags.append(f"owner_agents:{event['owner_id']}")
+    return tags
+
+
+class MemoryReadCache:
+    """
+    Per-process read cache with tag-based invalidation.
+
+    set() takes the time the value started loading and refuses to store it if
+    one of its tags was invalidated meanwhile, so a slow query can't put a
+    pre-event result back into the cache.
+    """
+
+    backend = "memory"
+
+    def __init__(self):
+        self._entries = {}  # key -> (expires_at, value)
+        self._tags = {}  # tag -> set of keys
+        self._invalidated_at = {}  # tag -> time of last invalidation
+
+    def now(self):
+        return time.monotonic()
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        return entry[1]
+
+    async def invalidated_after(self, tags, since):
+        return any(self._invalidated_at.get(tag, -1) >= since for tag in tags)
+
+    async def set(self, key, value, tags, since, ttl=READ_CACHE_TTL_SECONDS):
+        if await self.invalidated_after(tags, since):
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+
+    async def invalidate(self, tags):
+        now = time.monotonic()
+        for tag in tags:
+            self._invalidated_at[tag] = now
+            for key in self._tags.pop(tag, ()):
+                self._entries.pop(key, None)
+
+
+class RedisReadCache:
+    """Read cache shared by all workers, stored as JSON strings in Redis"""
+
+    backend = "redis"
+    prefix = "read_cache:"
+
+    def __init__(self, redis_pool):
+        self.redis = redis_pool
+
+    def now(self):
+        # Wall clock, since invalidation times are compared across workers
+        return time.time()
+
+    async def get(self, key):
+        raw = await self.redis.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    async def invalidated_after(self, tags, since):
+        invalidated = await self.redis.hmget(f"{self.prefix}invalidated_at", tags)
+        return any(at is not None and float(at) >= since for at in invalidated)
+
+    async def set(self, key, value, tags, since, ttl=READ_CACHE_TTL_SECONDS):
+        if await self.invalidated_after(tags, since):
+            return
+        pipe = self.redis.pipeline()
+        pipe.set(self.prefix + key, json.dumps(value), ex=ttl)
+        for tag in tags:
+            pipe.sadd(f"{self.prefix}tag:{tag}", self.prefix + key)
+            pipe.expire(f"{self.prefix}tag:{tag}", ttl)
+        await pipe.execute()
+
+    async def invalidate(self, tags):
+        if not tags:
+            return
+        await self.redis.hset(f"{self.prefix}invalidated_at", mapping={tag: time.time() for tag in tags})
+        for tag in tags:
+            tag_key = f"{self.prefix}tag:{tag}"
+            keys = await self.redis.smembers(tag_key)
+            await self.redis.delete(tag_key, *keys)
+
+
+class MemoryCollectionVersions:
+    """
+    Per-process version counters for list endpoints, bumped on every write.
+
+    Versions carry a per-process prefix so an ETag handed out by one process
+    (or before a restart) never matches another's counter.
+    """
+
+    backend = "memory"
+
+    def __init__(self):
+        self._prefix = uuid.uuid4().hex[:8]
+        self._versions = {}
+        self._bumped_at = {}  # collection -> time of last bump
+
+    def now(self):
+        return time.monotonic()
+
+    async def get(self, collection):
+        return f"{self._prefix}.{self._versions.get(collection, 0)}"
+
+    async def bumped_after(self, collection, since):
+        return self._bumped_at.get(collection, -1) >= since
+
+    async def bump(self, collections):
+        now = time.monotonic()
+        for collection in collections:
+            self._versions[collection] = self._versions.get(collection, 0) + 1
+            self._bumped_at[collection] = now
+
+
+class RedisCollectionVersions:
+    """Version counters shared by all workers; one GET per conditional request"""
+
+    backend = "redis"
+    prefix = "collection_version:"
+
+    def __init__(self, redis_pool):
+        self.redis = redis_pool
+
+    def now(self):
+        # Wall clock, since bump times are compared across workers
+        return time.time()
+
+    async def get(self, collection):
+        key = self.prefix + collection
+        version = await self.redis.get(key)
+        if version is None:
+            # Seed from the clock, so a flushed counter can't repeat an old version
+            await self.redis.set(key, int(time.time() * 1000), nx=True)
+            version = await self.redis.get(key)
+        return version
+
+    async def bumped_after(self, collection, since):
+        at = await self.redis.hget(f"{self.prefix}bumped_at", collection)
+        return at is not None and float(at) >= since
+
+    async def bump(self, collections):
+        if not collections:
+            return
+        pipe = self.redis.pipeline()
+        for collection in collections:
+            pipe.incr(self.prefix + collection)
+        pipe.hset(f"{self.prefix}bumped_at", mapping={collection: time.time() for collection in collections})
+        await pipe.execute()
@@ -1,32 +1,142 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, make_url, text, exc
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
+import itertools
+import datetime
+import threading
+import time
+from collections import deque
 from dotenv import load_dotenv
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///backend/test.db")
+# Optional comma-separated read replica URLs; read-only GET handlers use these via get_read_db
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
 
-# For PostgreSQL: Explicitly use psycopg (v3) by changing postgresql:// to postgresql+psycopg://
-# This ensures SQLAlchemy uses psycopg v3 instead of trying psycopg2 first
-if DATABASE_URL.startswith("postgresql://") or DATABASE_URL.startswith("postgres://"):
-    # Convert to postgresql+psycopg:// to explicitly use psycopg (v3) driver
-    if DATABASE_URL.startswith("postgres://"):
-        DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql+psycopg://", 1)
-    elif DATABASE_URL.startswith("postgresql://"):
-        DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+psycopg://", 1)
-    connect_args = {}
-elif "sqlite" in DATABASE_URL:
-    # SQLite configuration
-    connect_args = {"check_same_thread": False}
-else:
-    connect_args = {}
-
-engine = create_engine(
-    DATABASE_URL,
-    connect_args=connect_args,
-    pool_pre_ping=True  # Verify connections before using them
-)
+# Connection pool, per engine (primary and each replica) and per worker process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+# Retire connections before server or proxy idle timeouts (often 30-60 min) can cut them
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1200"))
+# Off by default: recycling plus disconnect invalidation replaces a round-trip per checkout
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))  # Postgres only; 0 disables
+
+def _engine_args(url):
+    # For PostgreSQL: Explicitly use psycopg (v3) by changing postgresql:// to postgresql+psycopg://
+    # This ensures SQLAlchemy uses psycopg v3 instead of trying psycopg2 first
+    if url.startswith("postgresql://") or url.startswith("postgres://"):
+        # Convert to postgresql+psycopg:// to explicitly use psycopg (v3) driver
+        if url.startswith("postgres://"):
+            url = url.replace("postgres://", "postgresql+psycopg://", 1)
+        elif url.startswith("postgresql://"):
+            url = url.replace("postgresql://", "postgresql+psycopg://", 1)
+        connect_args = {
+            # TCP keepalives let the OS notice dead peers on idle pooled connections
+            "keepalives": 1,
+            "keepalives_idle": 60,
+            "keepalives_interval": 10,
+            "keepalives_count": 3,
+        }
+        if DB_STATEMENT_TIMEOUT_MS > 0:
+            connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    elif "sqlite" in url:
+        # SQLite configuration
+        connect_args = {"check_same_thread": False}
+    else:
+        connect_args = {}
+    return url, connect_args
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait and how often they time out"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.recent_waits = deque(maxlen=1000)
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+                self.recent_waits.append(waited)
+
+def pool_metrics(engine):
+    pool = engine.pool
+    metrics = {"url": engine.url.render_as_string(hide_password=True), "pool": type(pool).__name__}
+    if not isinstance(pool, QueuePool):
+        return metrics
+    metrics.update(
+        size=pool.size(),
+        max_overflow=pool._max_overflow,
+        checked_out=pool.checkedout(),
+        checked_in=pool.checkedin(),
+        # Negative while fewer than size connections have been opened
+        overflow=pool.overflow(),
+        timeout_seconds=pool.timeout(),
+        recycle_seconds=pool._recycle,
+    )
+    if isinstance(pool, MeteredQueuePool):
+        with pool._stats_lock:
+            waits = sorted(pool.recent_waits)
+            metrics.update(
+                checkouts=pool.checkouts,
+                checkout_timeouts=pool.timeouts,
+                wait_avg_ms=round(1000 * pool.wait_total / pool.checkouts, 3) if pool.checkouts else 0.0,
+                wait_max_ms=round(1000 * pool.wait_max, 3),
+                wait_p99_recent_ms=round(1000 * waits[int(len(waits) * 0.99)], 3) if waits else 0.0,
+            )
+    return metrics
+
+def _create_engine(url):
+    url, connect_args = _engine_args(url)
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        # In-memory SQLite lives in one connection; keep SQLAlchemy's singleton pool
+        return create_engine(url, connect_args=connect_args)
+    return create_engine(
+        url,
+        connect_args=connect_args,
+        poolclass=MeteredQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=DB_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        # Hand out the most recently used connection so surplus ones go idle and get recycled
+        pool_use_lifo=True,
+    )
+
+DATABASE_URL, connect_args = _engine_args(DATABASE_URL)
+
+engine = _create_engine(DATABASE_URL)
+
+replica_engines = [_create_engine(replica_url) for replica_url in DATABASE_REPLICA_URLS]
+
+# Filled in by check_replicas(); a replica is only used once it has been seen healthy
+replica_status = [
+    {"url": e.url.render_as_string(hide_password=True), "healthy": False, "lag_seconds": None, "checked_at": None, "error": None}
+    for e in replica_engines
+]
+_replica_cursor = itertools.count()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -38,3 +148,38 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def _replica_lag(conn):
+    if conn.dialect.name == "postgresql":
+        # An idle replica that has replayed everything it received is current,
+        # however old its last replayed transaction is. NULL on a primary or a
+        # replica that hasn't replayed anything yet.
+        lag = conn.execute(text(
+            "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+            " ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+        )).scalar()
+        return float(lag) if lag is not None else 0.0
+    conn.execute(text("SELECT 1"))
+    return 0.0
+
+def check_replicas():
+    """Probe every replica for reachability and replication lag"""
+    for replica, status in zip(replica_engines, replica_status):
+        try:
+            with replica.connect() as conn:
+                lag = _replica_lag(conn)
+            status.update(healthy=lag <= REPLICA_MAX_LAG_SECONDS, lag_seconds=lag, error=None)
+        except Exception as e:
+            status.update(healthy=False, lag_seconds=None, error=str(e))
+        status["checked_at"] = datetime.datetime.utcnow().isoformat()
+    return replica_status
+
+def pick_read_engine():
+    """Round-robin over healthy replicas, falling back to the primary"""
+    healthy = [e for e, status in zip(replica_engines, replica_status) if status["healthy"]]
+    if not healthy:
+        return engine
+    return healthy[next(_replica_cursor) % len(healthy)]
+
+def read_session(use_primary=False):
+    return SessionLocal(bind=engine if use_primary else pick_read_engine())
@@ -0,0 +1,214 @@
+"""
+Automatic dispatch of pending orders.
+
+Each cycle takes a batch of the oldest pending orders and the agents that
+have an approved, available vehicle and a recent position, builds an
+orders x agents cost matrix (haversine distance from the agent's latest
+DriverLocation to the pickup point, plus a penalty per order the agent is
+already carrying) and solves the assignment. With scipy installed and a
+batch small enough, scipy's linear_sum_assignment gives the optimum;
+otherwise a vectorized greedy solver handles thousands of orders in well
+under a second.
+"""
+import datetime
+import os
+
+from sqlalchemy import and_, or_, func
+
+from backend.eta import haversine_m, ACTIVE_ORDER_STATUSES
+from backend.models import User, Order, Vehicle, DriverLocation
+
+DISPATCH_BATCH_SIZE = int(os.getenv("DISPATCH_BATCH_SIZE", "5000"))
+DISPATCH_MAX_ORDERS_PER_AGENT = int(os.getenv("DISPATCH_MAX_ORDERS_PER_AGENT", "5"))
+DISPATCH_LOAD_COST_M = float(os.getenv("DISPATCH_LOAD_COST_M", "2000"))  # each active order weighs like this many meters
+DISPATCH_MAX_DISTANCE_M = float(os.getenv("DISPATCH_MAX_DISTANCE_M", "50000"))  # never assign farther than this
+DISPATCH_LOCATION_MAX_AGE_SECONDS = int(os.getenv("DISPATCH_LOCATION_MAX_AGE_SECONDS", "900"))
+DISPATCH_OPTIMAL_MAX_CELLS = 2_000_000  # larger problems use the greedy solver even with scipy
+
+UNREACHABLE = 1e12  # stands in for infinite cost where a solver needs finite values
+
+
+def cost_matrix(order_lat, order_lon, agent_lat, agent_lon, agent_load):
+    """(orders x agents) cost in meters; pairs beyond DISPATCH_MAX_DISTANCE_M are inf"""
+    import numpy as np
+
+    distance = haversine_m(
+        np.asarray(order_lat, dtype=float)[:, None], np.asarray(order_lon, dtype=float)[:, None],
+        np.asarray(agent_lat, dtype=float)[None, :], np.asarray(agent_lon, dtype=float)[None, :],
+    )
+    cost = distance + DISPATCH_LOAD_COST_M * np.asarray(agent_load, dtype=float)[None, :]
+    cost[distance > DISPATCH_MAX_DISTANCE_M] = np.inf
+    return cost
+
+
+def _assign_greedy(cost, capacity):
+    """
+    Rounds of: every order picks its cheapest agent with room left, every
+    agent keeps its cheapest picks up to its room, losers try again with the
+    load penalty of the winners applied.
+    """
+    import numpy as np
+
+    cost = cost.copy()
+    capacity = capacity.copy()
+    assignment = np.full(cost.shape[0], -1)
+    pending = np.arange(cost.shape[0])
+    while pending.size and capacity.any():
+        sub = cost[pending]
+        sub[:, capacity <= 0] = np.inf
+        best = sub.argmin(axis=1)
+        best_cost = sub[np.arange(pending.size), best]
+        reachable = np.isfinite(best_cost)
+        if not reachable.any():
+            break
+        orders, agents, costs = pending[reachable], best[reachable], best_cost[reachable]
+        ranked = np.lexsort((costs, agents))
+        orders, agents = orders[ranked], agents[ranked]
+        # Position of each pick within its agent's group, cheapest first
+        rank = np.arange(agents.size) - np.searchsorted(agents, agents)
+        won = rank < capacity[agents]
+        assignment[orders[won]] = agents[won]
+        taken = np.bincount(agents[won], minlength=capacity.size)
+        capacity -= taken
+        cost += DISPATCH_LOAD_COST_M * taken[None, :]
+        pending = pending[assignment[pending] < 0]
+    return assignment
+
+
+def _assign_optimal(cost, capacity):
+    """Minimum total cost via linear_sum_assignment, one column per free slot"""
+    import numpy as np
+    from scipy.optimize import linear_sum_assignment
+
+    slot_agent = np.repeat(np.arange(capacity.size), capacity)
+    # The k-th extra order for an agent carries k more load penalties
+    slot_rank = np.arange(slot_agent.size) - np.searchsorted(slot_agent, slot_agent)
+    slots = cost[:, slot_agent] + DISPATCH_LOAD_COST_M * slot_rank[None, :]
+    slots[~np.isfinite(slots)] = UNREACHABLE
+    rows, cols = linear_sum_assignment(slots)
+    assignment = np.full(cost.shape[0], -1)
+    keep = slots[rows, cols] < UNREACHABLE
+    assignment[rows[keep]] = slot_agent[cols[keep]]
+    return assignment
+
+
+def assign(cost, capacity):
+    """
+    Agent index for each order row (-1 when unassigned). capacity holds how
+    many more orders each agent may take.
+    """
+    import numpy as np
+
+    capacity = np.maximum(np.asarray(capacity, dtype=int), 0)
+    if cost.size == 0 or not capacity.any():
+        return np.full(cost.shape[0], -1)
+    if cost.shape[0] * int(capacity.sum()) <= DISPATCH_OPTIMAL_MAX_CELLS:
+        try:
+            return _assign_optimal(cost, capacity)
+        except ImportError:
+            pass
+    return _assign_greedy(cost, capacity)
+
+
+def _available_agents(db):
+    """[(agent_id, latitude, longitude, active order count)] for agents that can take orders"""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=DISPATCH_LOCATION_MAX_AGE_SECONDS)
+    agent_ids = [
+        agent_id for (agent_id,) in
+        db.query(Vehicle.assigned_agent_id)
+        .join(User, User.id == Vehicle.assigned_agent_id)
+        .filter(
+            User.role == "agent",
+            Vehicle.approval_status == "approved",
+            Vehicle.status == "available",
+        )
+        .distinct()
+    ]
+    if not agent_ids:
+        return []
+    latest = (
+        db.query(DriverLocation.agent_id, func.max(DriverLocation.timestamp).label("max_timestamp"))
+        .filter(DriverLocation.agent_id.in_(agent_ids), DriverLocation.timestamp >= cutoff)
+        .group_by(DriverLocation.agent_id)
+        .subquery()
+    )
+    positions = {
+        agent_id: (latitude, longitude)
+        for agent_id, latitude, longitude in
+        db.query(DriverLocation.agent_id, DriverLocation.latitude, DriverLocation.longitude).join(
+            latest,
+            (DriverLocation.agent_id == latest.c.agent_id) & (DriverLocation.timestamp == latest.c.max_timestamp),
+        )
+    }
+    loads = dict(
+        db.query(Order.assigned_agent_id, func.count(Order.id))
+        .filter(Order.assigned_agent_id.in_(list(positions)), Order.status.in_(ACTIVE_ORDER_STATUSES))
+        .group_by(Order.assigned_agent_id)
+    )
+    return [(agent_id, lat, lon, loads.get(agent_id, 0)) for agent_id, (lat, lon) in positions.items()]
+
+
+def _has_pickup():
+    return and_(Order.pickup_latitude.isnot(None), Order.pickup_longitude.isnot(None))
+
+
+def _has_delivery():
+    return and_(Order.delivery_latitude.isnot(None), Order.delivery_longitude.isnot(None))
+
+
+def _target(order):
+    """(lat, lon) the agent drives to first: the pickup, or the delivery when there is no pickup"""
+    if order.pickup_latitude is not None and order.pickup_longitude is not None:
+        return order.pickup_latitude, order.pickup_longitude
+    return order.delivery_latitude, order.delivery_longitude
+
+
+def dispatch_pending_orders(db):
+    """
+    Assign a batch of pending orders in one transaction. Returns the
+    assignments as dicts (order_id, owner_id, assigned_agent_id, old_agent_id)
+    plus a summary of the cycle.
+    """
+    import numpy as np
+
+    agents = _available_agents(db)
+    query = (
+        db.query(Order)
+        # Orders without a usable point can't be costed; filtered here so they
+        # never fill the batch and starve the ones behind them
+        .filter(Order.status == "pending", or_(_has_pickup(), _has_delivery()))
+        .order_by(Order.created_at, Order.id)
+        .limit(DISPATCH_BATCH_SIZE)
+    )
+    if db.bind.dialect.name == "postgresql":
+        # Orders an admin is approving right now are left for the next cycle
+        query = query.with_for_update(skip_locked=True, of=Order)
+    orders = query.all()
+    summary = {"pending": len(orders), "agents": len(agents), "assigned": 0}
+    if not orders or not agents:
+        db.rollback()
+        return [], summary
+
+    targets = [_target(order) for order in orders]
+    order_lat = [lat for lat, _ in targets]
+    order_lon = [lon for _, lon in targets]
+    agent_ids = np.array([a[0] for a in agents])
+    loads = np.array([a[3] for a in agents])
+    cost = cost_matrix(order_lat, order_lon, [a[1] for a in agents], [a[2] for a in agents], loads)
+    assignment = assign(cost, DISPATCH_MAX_ORDERS_PER_AGENT - loads)
+
+    assignments = []
+    for order, agent_index in zip(orders, assignment):
+        if agent_index < 0:
+            continue
+        assignments.append({
+            "order_id": order.id,
+            "owner_id": order.owner_id,
+            "assigned_agent_id": int(agent_ids[agent_index]),
+            "old_agent_id": order.assigned_agent_id,
+        })
+        order.assigned_agent_id = int(agent_ids[agent_index])
+        order.status = "approved"
+    db.commit()
+    summary["assigned"] = len(assignments)
+    return assignments, summary
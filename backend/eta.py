@@ -0,0 +1,177 @@
+import os
+import time
+from collections import deque
+
+ETA_WINDOW_POINTS = int(os.getenv("ETA_WINDOW_POINTS", "12"))
+ETA_WINDOW_SECONDS = float(os.getenv("ETA_WINDOW_SECONDS", "300"))
+ETA_DEFAULT_SPEED_MPS = float(os.getenv("ETA_DEFAULT_SPEED_MPS", "8.3"))  # ~30 km/h when speed is unknown
+ETA_MIN_SPEED_MPS = float(os.getenv("ETA_MIN_SPEED_MPS", "1.5"))  # floor so a stopped agent doesn't get an infinite ETA
+ETA_MAX_SPEED_MPS = float(os.getenv("ETA_MAX_SPEED_MPS", "40"))  # clamp for GPS jumps (~145 km/h)
+ETA_MIN_WINDOW_SECONDS = 5.0  # shorter windows are too noisy to estimate speed from
+ETA_DETOUR_FACTOR = float(os.getenv("ETA_DETOUR_FACTOR", "1.3"))  # road distance / straight-line distance
+ETA_CHANGE_SECONDS = float(os.getenv("ETA_CHANGE_SECONDS", "60"))
+ETA_CHANGE_RATIO = float(os.getenv("ETA_CHANGE_RATIO", "0.1"))
+
+ACTIVE_ORDER_STATUSES = ("approved", "picked_up", "in_transit")
+
+EARTH_RADIUS_M = 6371000.0
+
+
+class EtaEstimator:
+    """
+    Rolling per-agent position window and vectorized ETA computation.
+
+    Speed is the path length over the window divided by its duration, and
+    heading is the bearing of the window's net displacement. ETAs for every
+    active order are computed in one pass over numpy arrays.
+    """
+
+    def __init__(self):
+        self.windows = {}  # agent_id -> deque of (t, lat, lon)
+        self.etas = {}  # order_id -> last published ETA record
+        self.dirty = False
+
+    def observe(self, agent_id, latitude, longitude, t=None):
+        t = time.time() if t is None else t
+        window = self.windows.get(agent_id)
+        if window is None:
+            window = self.windows[agent_id] = deque(maxlen=ETA_WINDOW_POINTS)
+        # The same ping can arrive twice (local publish and the ops_events listener)
+        if window and window[-1][1] == latitude and window[-1][2] == longitude and t - window[-1][0] < 1:
+            return
+        window.append((t, latitude, longitude))
+        while window and window[0][0] < t - ETA_WINDOW_SECONDS:
+            window.popleft()
+        self.dirty = True
+
+    def motions(self, agent_ids):
+        """
+        Current position, speed (m/s) and heading (degrees) for several agents
+        at once, as arrays aligned with agent_ids; speed and heading are NaN
+        where the window is too short to tell. Every window is concatenated
+        into one array and reduced per agent segment, so the cost is a few
+        numpy passes however many agents there are.
+        """
+        import numpy as np
+
+        lengths = np.array([len(self.windows[agent_id]) for agent_id in agent_ids])
+        points = np.array([point for agent_id in agent_ids for point in self.windows[agent_id]], dtype=float)
+        ends = np.cumsum(lengths) - 1
+        starts = ends - lengths + 1
+        lat, lon = points[ends, 1], points[ends, 2]
+        duration = points[ends, 0] - points[starts, 0]
+        # Path length of each window: differences of the cumulative step sum
+        # never include the step that jumps from one agent's window to the next
+        steps = haversine_m(points[:-1, 1], points[:-1, 2], points[1:, 1], points[1:, 2])
+        travelled = np.concatenate(([0.0], np.cumsum(steps)))
+        path = travelled[ends] - travelled[starts]
+        known = (lengths >= 2) & (duration >= ETA_MIN_WINDOW_SECONDS)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speed = np.where(known, np.minimum(path / duration, ETA_MAX_SPEED_MPS), np.nan)
+        heading = np.where(known, bearing_deg(points[starts, 1], points[starts, 2], lat, lon), np.nan)
+        return lat, lon, speed, heading
+
+    def motion(self, agent_id):
+        """(latitude, longitude, speed m/s or None, heading degrees or None) for an agent"""
+        import numpy as np
+
+        if not self.windows.get(agent_id):
+            return None
+        lat, lon, speed, heading = (float(value[0]) for value in self.motions([agent_id]))
+        return lat, lon, None if np.isnan(speed) else speed, None if np.isnan(heading) else heading
+
+    def expire(self, now=None):
+        """
+        Forget agents whose newest point is older than ETA_WINDOW_SECONDS, so a
+        silent agent's last position and speed stop producing ETAs. Marks the
+        estimator dirty when that removes anyone, so their ETAs get withdrawn.
+        """
+        now = time.time() if now is None else now
+        stale = [agent_id for agent_id, window in self.windows.items() if not window or window[-1][0] < now - ETA_WINDOW_SECONDS]
+        for agent_id in stale:
+            del self.windows[agent_id]
+        if stale:
+            self.dirty = True
+        return len(stale)
+
+    def compute(self, orders, now=None):
+        """
+        ETA records for active orders with a recently tracked agent.
+
+        orders: iterable of (order_id, agent_id, owner_id, status, target_lat, target_lon, target).
+        Returns {order_id: record} for all orders that could be estimated.
+        """
+        import numpy as np
+
+        now = time.time() if now is None else now
+        self.expire(now)
+
+        rows = [
+            order for order in orders
+            if self.windows.get(order[1]) and order[4] is not None and order[5] is not None
+        ]
+        if not rows:
+            return {}
+
+        # Motion once per distinct agent, then gathered per order
+        agent_ids = list(dict.fromkeys(order[1] for order in rows))
+        agent_lat, agent_lon, agent_speed, agent_heading = self.motions(agent_ids)
+        index = {agent_id: i for i, agent_id in enumerate(agent_ids)}
+        by_order = np.array([index[order[1]] for order in rows])
+        speed = agent_speed[by_order]
+        speed = np.where(np.isnan(speed), ETA_DEFAULT_SPEED_MPS, speed)
+        heading = agent_heading[by_order]
+        target_lat = np.array([o[4] for o in rows], dtype=float)
+        target_lon = np.array([o[5] for o in rows], dtype=float)
+
+        distance = haversine_m(agent_lat[by_order], agent_lon[by_order], target_lat, target_lon) * ETA_DETOUR_FACTOR
+        eta_seconds = distance / np.maximum(speed, ETA_MIN_SPEED_MPS)
+
+        return {
+            order[0]: {
+                "order_id": order[0],
+                "agent_id": order[1],
+                "owner_id": order[2],
+                "status": order[3],
+                "target": order[6],
+                "distance_m": round(float(distance[i])),
+                "speed_mps": round(float(speed[i]), 2),
+                "heading": None if np.isnan(heading[i]) else round(float(heading[i])),
+                "eta_seconds": round(float(eta_seconds[i])),
+                "computed_at": now,
+            }
+            for i, order in enumerate(rows)
+        }
+
+    def changed(self, records):
+        """Records whose ETA moved past the threshold since last published; updates the cache"""
+        changed = []
+        for order_id, record in records.items():
+            previous = self.etas.get(order_id)
+            if previous is not None:
+                delta = abs(record["eta_seconds"] - previous["eta_seconds"])
+                if delta < max(ETA_CHANGE_SECONDS, ETA_CHANGE_RATIO * previous["eta_seconds"]):
+                    continue
+            self.etas[order_id] = record
+            changed.append(record)
+        # Orders that are no longer active drop out of the cache
+        for order_id in set(self.etas) - set(records):
+            del self.etas[order_id]
+        return changed
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    import numpy as np
+
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def bearing_deg(lat1, lon1, lat2, lon2):
+    import numpy as np
+
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    x = np.sin(lon2 - lon1) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(lon2 - lon1)
+    return (np.degrees(np.arctan2(x, y)) + 360) % 360
@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+from backend.db import read_session
+
+EXPORT_BATCH_SIZE = 1000  # rows fetched per round-trip from the server-side cursor
+EXPORT_CHUNK_BYTES = 64 * 1024  # flush the output buffer once it grows past this
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _format_rows(rows, columns, fmt):
+    """Turn result rows into text pieces; header first for CSV"""
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([_encode_value(v) for v in row])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+        yield buffer.getvalue()
+    else:
+        for row in rows:
+            record = {col: _encode_value(v) for col, v in zip(columns, row)}
+            yield json.dumps(record) + "\n"
+
+
+def stream_export(stmt, columns, fmt="csv", compress=False):
+    """
+    Generator yielding encoded export chunks for a select statement.
+
+    Rows are pulled through a server-side cursor (named cursor on Postgres,
+    batched fetches on SQLite) so memory stays flat regardless of row count.
+    A dedicated session (on a read replica when one is healthy) is opened here
+    because the generator outlives the request-scoped one from get_db.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31 = gzip container
+    db = read_session()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        pending = []
+        pending_size = 0
+        for piece in _format_rows(result, columns, fmt):
+            pending.append(piece)
+            pending_size += len(piece)
+            if pending_size >= EXPORT_CHUNK_BYTES:
+                data = "".join(pending).encode("utf-8")
+                pending, pending_size = [], 0
+                if compressor:
+                    data = compressor.compress(data)
+                if data:
+                    yield data
+        data = "".join(pending).encode("utf-8")
+        if compressor:
+            data = compressor.compress(data) + compressor.flush()
+        if data:
+            yield data
+    finally:
+        db.close()
@@ -0,0 +1,107 @@
+import math
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between two lat/lon points"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def _project(points):
+    """Equirectangular projection to meters around the track's mean latitude"""
+    mean_lat = math.radians(sum(p[0] for p in points) / len(points))
+    kx = math.cos(mean_lat) * math.pi * EARTH_RADIUS_M / 180.0
+    ky = math.pi * EARTH_RADIUS_M / 180.0
+    return [(p[1] * kx, p[0] * ky) for p in points]
+
+
+def _segment_distance(px, py, ax, ay, bx, by):
+    dx, dy = bx - ax, by - ay
+    if dx == 0 and dy == 0:
+        return math.hypot(px - ax, py - ay)
+    t = ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)
+    t = max(0.0, min(1.0, t))
+    return math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def simplify_track(points, tolerance_m):
+    """
+    Douglas-Peucker simplification of a list of (lat, lon, ...) tuples.
+
+    Tolerance is in meters. Uses an explicit stack instead of recursion so a
+    day-long track with tens of thousands of points can't blow the call stack.
+    Returns the kept points in their original order.
+    """
+    if tolerance_m <= 0 or len(points) < 3:
+        return list(points)
+
+    xy = _project(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xy[first]
+        bx, by = xy[last]
+        max_dist, index = 0.0, None
+        for i in range(first + 1, last):
+            dist = _segment_distance(xy[i][0], xy[i][1], ax, ay, bx, by)
+            if dist > max_dist:
+                max_dist, index = dist, i
+        if index is not None and max_dist > tolerance_m:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def _encode_signed(value):
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+
+def encode_polyline(points, precision=5):
+    """Encode (lat, lon, ...) tuples with the Google encoded polyline algorithm"""
+    factor = 10 ** precision
+    prev_lat = prev_lon = 0
+    out = []
+    for point in points:
+        lat = int(round(point[0] * factor))
+        lon = int(round(point[1] * factor))
+        out.append(_encode_signed(lat - prev_lat))
+        out.append(_encode_signed(lon - prev_lon))
+        prev_lat, prev_lon = lat, lon
+    return "".join(out)
+
+
+def decode_polyline(encoded, precision=5):
+    """Inverse of encode_polyline, returns a list of (lat, lon) tuples"""
+    factor = 10 ** precision
+    coords = []
+    index = lat = lon = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coords.append((lat / factor, lon / factor))
+    return coords
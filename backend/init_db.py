@@ -1,7 +1,7 @@
-from backend.db import Base, engine
-from backend import models
+from backend.db import engine
+from backend.migrations import migrate
 
-# Create all tables
-Base.metadata.create_all(bind=engine)
+# Create all tables and indexes, recording the schema version
+migrate(engine)
 print("✅ Database tables created successfully!")
 print("You can now create users via the API signup endpoint.")
@@ -1,62 +1,367 @@
 from backend import db, models
-from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Security
+from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Security, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from backend.models import User, Order, DriverLocation, Vehicle
-from backend.db import SessionLocal
+from backend.models import User, Order, DriverLocation, Vehicle, AgentPosition
+from backend.db import (
+    SessionLocal, read_session, check_replicas, replica_engines, replica_status, pool_metrics,
+    REPLICA_MAX_LAG_SECONDS, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+)
 from pydantic import BaseModel, EmailStr
 from fastapi.security import OAuth2PasswordBearer
 from typing import List
-from backend.models import Base
-from backend.db import engine
+from contextlib import asynccontextmanager
+from functools import lru_cache
 import json
-import redis.asyncio as redis
 import asyncio
-from passlib.context import CryptContext
+import anyio
 from jose import JWTError, jwt
 import os
-from dotenv import load_dotenv
-from datetime import datetime, timedelta
-
-load_dotenv(dotenv_path="./backend/.env")
-
-app= FastAPI()
-
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, replace with your frontend URL
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+from datetime import datetime, timedelta, timezone
+import hashlib
+import uuid
+import time
+from sqlalchemy import select
+from backend.exports import stream_export, EXPORT_MEDIA_TYPES
+from backend.geo import simplify_track, encode_polyline
+from backend.mapview import query_layer, MAP_LAYERS
+from backend.admission import LocationAdmission, RedisLocationAdmission, ACCEPT, MERGE, DROP
+from backend.migrations import migrate, current_version, LATEST_VERSION
+from backend.realtime import EventBatcher, encode_frame, WS_ENCODINGS, WS_MAX_BATCH_MS
+from backend.presence import LocalRegistry, RedisRegistry, user_channel, WS_HEARTBEAT_SECONDS, WORKER_ID
+from backend.eta import EtaEstimator, ACTIVE_ORDER_STATUSES
+from backend.dispatch import dispatch_pending_orders
+from backend.profiler import SamplingProfiler, ProfilerMiddleware
+from backend.cache import (
+    MemoryReadCache, RedisReadCache, MemoryCollectionVersions, RedisCollectionVersions,
+    event_tags, EVENT_COLLECTIONS, READ_CACHE_VEHICLES_TTL_SECONDS,
 )
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+
+# Nothing in this module touches the database, Redis or bcrypt at import time;
+# that all happens in lifespan() or on first use, so importing the app is cheap
+# and survives a database outage. Environment variables are loaded by backend.db.
 
 redis_pool = None
 redis_available = False
 
-load_dotenv("startup")
+# "auto" shares admission state through Redis when it is reachable, "off" admits everything
+LOCATION_ADMISSION = os.getenv("LOCATION_ADMISSION", "auto")
+location_admission = LocationAdmission()
+
+# "memory" keeps a per-worker cache (invalidated across workers via ops_events), "redis" shares one
+READ_CACHE = os.getenv("READ_CACHE", "memory")
+read_cache = MemoryReadCache()
+collection_versions = MemoryCollectionVersions()
 
-Base.metadata.create_all(bind=db.engine)
+# Live sockets and agent presence; shared across workers through Redis when it is reachable
+registry = LocalRegistry()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Rolling agent velocity and per-order ETAs, pushed as eta_update events
+ETA_ENABLED = os.getenv("ETA_ENABLED", "true").lower() == "true"
+ETA_INTERVAL_SECONDS = float(os.getenv("ETA_INTERVAL_SECONDS", "15"))
+eta_estimator = EtaEstimator()
+# Background assignment of pending orders; off by default, admins approve by hand
+DISPATCH_ENABLED = os.getenv("DISPATCH_ENABLED", "false").lower() == "true"
+DISPATCH_INTERVAL_SECONDS = float(os.getenv("DISPATCH_INTERVAL_SECONDS", "30"))
+last_dispatch = None
+
+background_tasks = []
+
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    # passlib + bcrypt backend are only loaded when a password is first hashed or checked
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 SECRET_KEY  = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 24 * 60  # 24 hours for better persistence
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login/")
 
-@app.on_event("startup")
+# Migrations run as a deploy step (backend/migrate_db.py, see start.sh); only an
+# empty database is migrated on boot. Set to "true" to also let a booting
+# worker upgrade an existing schema; other workers skip rather than wait on
+# the migration lock.
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "false").lower() == "true"
+
+def ensure_schema():
+    """Cheap version check on boot; logs and keeps serving when the database is behind"""
+    version = current_version(db.engine)
+    if version >= LATEST_VERSION:
+        return
+    if version == 0:
+        # An empty database has no tables to lock anyone out of, and nothing
+        # works until they exist; other workers wait on the lock, then skip
+        migrate(db.engine)
+    elif MIGRATE_ON_STARTUP:
+        if migrate(db.engine, wait=False) is None:
+            print("Another process is migrating the database; serving on the current schema.")
+    else:
+        print(f"Database schema is at version {version}, expected {LATEST_VERSION}. Run backend/migrate_db.py.")
+
+REDIS_CONNECT_TIMEOUT_SECONDS = float(os.getenv("REDIS_CONNECT_TIMEOUT_SECONDS", "2"))
+# Worker threads for sync handlers; defaults to what the primary pool can serve at once
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", str(DB_POOL_SIZE + DB_MAX_OVERFLOW)))
+
 async def startup():
-    global redis_pool, redis_available
+    global redis_pool, redis_available, location_admission, read_cache, registry, collection_versions
+    # More sync handlers in flight than the pool has connections would only
+    # queue inside the pool and end in checkout timeouts
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    try:
+        await run_in_threadpool(ensure_schema)
+    except Exception as e:
+        # Keep serving; requests needing the database fail until it is back
+        print(f"Database not available at startup: {e}. Skipping schema check.")
     redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
     try:
-        redis_pool = await redis.from_url(redis_url, decode_responses=True)
+        import redis.asyncio as redis
+        redis_pool = await redis.from_url(
+            redis_url,
+            decode_responses=True,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT_SECONDS,
+        )
         # Test connection
         await redis_pool.ping()
         redis_available = True
     except Exception as e:
         print(f"Redis not available: {e}. Continuing without Redis (real-time features disabled).")
         redis_available = False
+    
+    if redis_available and LOCATION_ADMISSION in ("auto", "redis"):
+        location_admission = RedisLocationAdmission(redis_pool)
+    if redis_available:
+        registry = RedisRegistry(redis_pool)
+        background_tasks.append(asyncio.create_task(registry_heartbeat_loop()))
+    if replica_engines:
+        background_tasks.append(asyncio.create_task(replica_health_loop()))
+    if redis_available and READ_CACHE == "redis":
+        read_cache = RedisReadCache(redis_pool)
+    if redis_available:
+        # ETags must agree across workers, whichever one a poll lands on
+        collection_versions = RedisCollectionVersions(redis_pool)
+    if redis_available:
+        # Events published by other workers must reach this worker's cache and ETA state too
+        background_tasks.append(asyncio.create_task(ops_events_listener()))
+    if ETA_ENABLED:
+        background_tasks.append(asyncio.create_task(eta_loop()))
+    if DISPATCH_ENABLED:
+        background_tasks.append(asyncio.create_task(dispatch_loop()))
+
+async def shutdown():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    try:
+        await registry.close()
+    except Exception as e:
+        print(f"Could not deregister worker: {e}")
+    if redis_pool is not None:
+        await redis_pool.aclose()
+    db.engine.dispose()
+    for replica in replica_engines:
+        replica.dispose()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    yield
+    await shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# Added first so it is the innermost middleware and shares the endpoint's task
+profiler = SamplingProfiler()
+app.add_middleware(ProfilerMiddleware, profiler=profiler)
+
+async def run_in_threadpool(func, *args, **kwargs):
+    """Threadpool work of async handlers, visible to the profiler when their request is sampled"""
+    return await profiler.run_in_threadpool(func, *args, **kwargs)
+
+# Add CORS middleware
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # In production, replace with your frontend URL
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+async def registry_heartbeat_loop():
+    while True:
+        try:
+            await registry.heartbeat()
+        except Exception as e:
+            print(f"Registry heartbeat failed: {e}")
+        await asyncio.sleep(WS_HEARTBEAT_SECONDS)
+
+async def replica_health_loop():
+    while True:
+        await run_in_threadpool(check_replicas)
+        await asyncio.sleep(REPLICA_HEALTH_INTERVAL_SECONDS)
+
+def observe_event(event: dict):
+    if event.get("event") == "location_update":
+        eta_estimator.observe(event["agent_id"], event["latitude"], event["longitude"])
+    elif event.get("event") == "order_status":
+        eta_estimator.dirty = True
+
+async def ops_events_listener():
+    pubsub = redis_pool.pubsub()
+    await pubsub.subscribe("ops_events")
+    try:
+        async for message in pubsub.listen():
+            if message['type'] == 'message':
+                try:
+                    event = json.loads(message['data'])
+                except ValueError:
+                    continue
+                if read_cache.backend == "memory":
+                    await read_cache.invalidate(event_tags(event))
+                observe_event(event)
+    finally:
+        await pubsub.close()
+
+async def publish_event(event: dict):
+    """Invalidate cached reads and ETags affected by the event, then broadcast it on ops_events"""
+    await read_cache.invalidate(event_tags(event))
+    await collection_versions.bump(EVENT_COLLECTIONS.get(event.get("event"), []))
+    observe_event(event)
+    if redis_available:
+        await redis_pool.publish("ops_events", json.dumps(event))
+
+def _load_active_orders():
+    session = read_session()
+    try:
+        rows = session.query(
+            Order.id, Order.assigned_agent_id, Order.owner_id, Order.status,
+            Order.pickup_latitude, Order.pickup_longitude,
+            Order.delivery_latitude, Order.delivery_longitude,
+        ).filter(Order.status.in_(ACTIVE_ORDER_STATUSES), Order.assigned_agent_id.isnot(None)).all()
+    finally:
+        session.close()
+    orders = []
+    for order_id, agent_id, owner_id, status, p_lat, p_lon, d_lat, d_lon in rows:
+        # Before pickup the agent heads to the pickup point (when there is one), then to delivery
+        if status == "approved" and p_lat is not None and p_lon is not None:
+            orders.append((order_id, agent_id, owner_id, status, p_lat, p_lon, "pickup"))
+        else:
+            orders.append((order_id, agent_id, owner_id, status, d_lat, d_lon, "delivery"))
+    return orders
+
+async def _is_leader(key: str, ttl: int):
+    """With several workers, only the one holding key in Redis runs the job"""
+    if not redis_available:
+        return True
+    if await redis_pool.set(key, WORKER_ID, nx=True, ex=ttl):
+        return True
+    if await redis_pool.get(key) == WORKER_ID:
+        await redis_pool.expire(key, ttl)
+        return True
+    return False
+
+async def update_etas():
+    # Agents that went silent withdraw their ETAs even when nobody else moved
+    eta_estimator.expire()
+    if not eta_estimator.dirty or not await _is_leader("eta:leader", int(ETA_INTERVAL_SECONDS * 3)):
+        return
+    eta_estimator.dirty = False
+    orders = await run_in_threadpool(_load_active_orders)
+    records = eta_estimator.compute(orders)
+    changed = eta_estimator.changed(records)
+    if redis_available:
+        pipe = redis_pool.pipeline()
+        pipe.delete("eta:orders")
+        if eta_estimator.etas:
+            pipe.hset("eta:orders", mapping={order_id: json.dumps(r) for order_id, r in eta_estimator.etas.items()})
+        await pipe.execute()
+    for record in changed:
+        await publish_event(dict(record, event="eta_update"))
+
+async def eta_loop():
+    while True:
+        await asyncio.sleep(ETA_INTERVAL_SECONDS)
+        try:
+            await update_etas()
+        except Exception as e:
+            print(f"ETA update failed: {e}")
+
+async def run_dispatch():
+    """One dispatch cycle: assign pending orders, then announce them like approve_order does"""
+    global last_dispatch
+    started = time.perf_counter()
+    session = SessionLocal()
+    try:
+        assignments, summary = await run_in_threadpool(dispatch_pending_orders, session)
+    finally:
+        session.close()
+    for assignment in assignments:
+        await publish_assignment(assignment["order_id"], "approved", assignment["owner_id"],
+                                 assignment["assigned_agent_id"], assignment["old_agent_id"])
+    summary.update(worker=WORKER_ID, finished_at=datetime.utcnow().isoformat(),
+                   seconds=round(time.perf_counter() - started, 3))
+    last_dispatch = summary
+    return summary
+
+async def dispatch_loop():
+    while True:
+        await asyncio.sleep(DISPATCH_INTERVAL_SECONDS)
+        try:
+            if await _is_leader("dispatch:leader", int(DISPATCH_INTERVAL_SECONDS * 3)):
+                await run_dispatch()
+        except Exception as e:
+            print(f"Dispatch cycle failed: {e}")
+
+async def publish_assignment(order_id: int, status: str, owner_id: int, agent_id: int, old_agent_id: int):
+    await publish_event({
+        "event": "order_status",
+        "order_id": order_id,
+        "new_status": status,
+        "owner_id": owner_id,
+        "assigned_agent_id": agent_id,
+        "old_agent_id": old_agent_id
+    })
+    if agent_id != old_agent_id:
+        await send_to_user(agent_id, {
+            "event": "order_assigned",
+            "order_id": order_id,
+            "status": status
+        })
+
+async def send_to_user(user_id: int, event: dict):
+    """Deliver an event to one user's /ws/orders sockets, on whichever worker holds them"""
+    # Without Redis /ws/orders refuses connections, so there is no one to deliver to
+    if redis_available:
+        await redis_pool.publish(user_channel(user_id), json.dumps(event))
+
+async def cached_read(key: str, tags: List[str], db: Session, loader, ttl: int = None):
+    """
+    Read-through cache for list endpoints. loader(db) runs in the threadpool on
+    a miss and its JSON-ready result is cached under key until one of tags is
+    invalidated by an event (or ttl runs out).
+    """
+    cached = await read_cache.get(key)
+    if cached is None:
+        since = read_cache.now()
+        if replica_engines and await read_cache.invalidated_after(tags, since - REPLICA_MAX_LAG_SECONDS):
+            # A lagging replica may not have the write behind that invalidation yet,
+            # and whatever we load now stays cached, so load it from the primary
+            primary = read_session(use_primary=True)
+            try:
+                cached = jsonable_encoder(await run_in_threadpool(loader, primary))
+            finally:
+                primary.close()
+        else:
+            cached = jsonable_encoder(await run_in_threadpool(loader, db))
+        if ttl is None:
+            await read_cache.set(key, cached, tags, since)
+        else:
+            await read_cache.set(key, cached, tags, since, ttl=ttl)
+    return cached
 
 def get_db():
     db = SessionLocal()
@@ -66,6 +371,80 @@ def get_db():
         db.close()
 
 
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+REPLICA_HEALTH_INTERVAL_SECONDS = float(os.getenv("REPLICA_HEALTH_INTERVAL_SECONDS", "10"))
+recent_writers = {}  # client key -> monotonic time until which reads stick to the primary
+
+def _client_key(request):
+    auth = request.headers.get("authorization")
+    if auth:
+        return hashlib.sha1(auth.encode()).hexdigest()
+    return request.client.host if request.client else "anonymous"
+
+async def _mark_writer(request):
+    key = _client_key(request)
+    now = time.monotonic()
+    # Re-inserted so entries stay in expiry order and expired ones can be
+    # dropped from the front; clients that never read again would pile up otherwise
+    recent_writers.pop(key, None)
+    while recent_writers:
+        oldest = next(iter(recent_writers))
+        if recent_writers[oldest] > now:
+            break
+        del recent_writers[oldest]
+    recent_writers[key] = now + READ_YOUR_WRITES_SECONDS
+    if redis_available:
+        # Other workers may serve this client's next read
+        await redis_pool.set(f"rw_sticky:{key}", 1, px=int(READ_YOUR_WRITES_SECONDS * 1000))
+
+class WriteTrackingMiddleware:
+    """
+    Remember clients that just wrote so their next reads go to the primary.
+    Pure ASGI: without replicas, and for reads (streaming exports, SSE), the
+    request passes straight through instead of costing a BaseHTTPMiddleware task.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not replica_engines or scope["method"] not in ("POST", "PUT", "PATCH", "DELETE"):
+            return await self.app(scope, receive, send)
+
+        async def send_marking(message):
+            # Marked before the client sees the response, so its next read already sticks
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                await _mark_writer(Request(scope))
+            await send(message)
+
+        await self.app(scope, receive, send_marking)
+
+app.add_middleware(WriteTrackingMiddleware)
+
+async def _is_sticky(request):
+    if not replica_engines:
+        return False
+    key = _client_key(request)
+    until = recent_writers.get(key)
+    if until is not None:
+        if until > time.monotonic():
+            return True
+        recent_writers.pop(key, None)
+    if redis_available:
+        return bool(await redis_pool.exists(f"rw_sticky:{key}"))
+    return False
+
+async def get_read_db(request: Request):
+    """
+    Session for read-only handlers: a healthy replica, or the primary if the
+    client wrote within READ_YOUR_WRITES_SECONDS (read-your-writes).
+    """
+    db = read_session(use_primary=await _is_sticky(request))
+    try:
+        yield db
+    finally:
+        db.close()
+
 def get_current_user(token: str = Security(oauth2_scheme)):   
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -94,10 +473,10 @@ def hash_password(password: str):
     if len(password) > 72:  
         raise HTTPException(status_code=400, detail="Password too long (max 72 characters)")
 
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 
 class SetupRequest(BaseModel):
@@ -156,19 +535,26 @@ class UserLogin(BaseModel):
     password: str
 
 class ConnectionManager:
+    """This worker's sockets; the cross-worker view lives in the registry"""
+
     def __init__(self):
         self.active_connections: List[WebSocket] = []
+        self.connection_ids = {}  # websocket -> registry id
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, user: dict = None):
         await websocket.accept()
         self.active_connections.append(websocket)
+        conn_id = uuid.uuid4().hex
+        self.connection_ids[websocket] = conn_id
+        user_id = user.get("user_id") if user else None
+        await registry.register(conn_id, user_id, user.get("role") if user else None)
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    async def disconnect(self, websocket: WebSocket):
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+        conn_id = self.connection_ids.pop(websocket, None)
+        if conn_id:
+            await registry.unregister(conn_id)
 
 manager = ConnectionManager()
 
@@ -256,15 +642,13 @@ async def signup(user: UserCreate, db: Session = Depends(get_db)):
     db.commit()
     db.refresh(db_user)
     # Broadcast signup event to admins
-    if redis_available:
-        message = json.dumps({
-            "event": "user_signup",
-            "user_id": db_user.id,
-            "name": db_user.name,
-            "email": db_user.email,
-            "role": db_user.role
-        })
-        await redis_pool.publish("ops_events", message)
+    await publish_event({
+        "event": "user_signup",
+        "user_id": db_user.id,
+        "name": db_user.name,
+        "email": db_user.email,
+        "role": db_user.role
+    })
     return {"message": "User created successfully"}
 
 @app.post("/login/", response_model=Token)
@@ -287,19 +671,24 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
 
 
 @app.get("/users/{user_id}")
-def read_user(user_id: int, db: Session = Depends(get_db)):
+def read_user(user_id: int, db: Session = Depends(get_read_db)):
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 @app.get("/admin/users/")
-def list_all_users(
-    db: Session = Depends(get_db),
+async def list_all_users(
+    db: Session = Depends(get_read_db),
     current_user: dict = Depends(require_role(["admin"]))
 ):
     # Filter out rejected users from the list
-    return db.query(User).filter(User.role != "rejected").all()
+    return JSONResponse(await cached_read(
+        "users:admin",
+        ["users"],
+        db,
+        lambda session: session.query(User).filter(User.role != "rejected").all(),
+    ))
 
 class UserRoleUpdate(BaseModel):
     role: str  # "owner", "agent", "admin", "rejected"
@@ -320,25 +709,21 @@ async def update_user_role(
         db.delete(db_user)
         db.commit()
         # Broadcast user deleted event
-        if redis_available:
-            message = json.dumps({
-                "event": "user_deleted",
-                "user_id": user_id
-            })
-            await redis_pool.publish("ops_events", message)
+        await publish_event({
+            "event": "user_deleted",
+            "user_id": user_id
+        })
         return {"message": "User rejected and deleted successfully"}
     
     db_user.role = role_update.role
     db.commit()
     db.refresh(db_user)
     # Broadcast role update event
-    if redis_available:
-        message = json.dumps({
-            "event": "user_role_updated",
-            "user_id": user_id,
-            "new_role": role_update.role
-        })
-        await redis_pool.publish("ops_events", message)
+    await publish_event({
+        "event": "user_role_updated",
+        "user_id": user_id,
+        "new_role": role_update.role
+    })
     return db_user
 
 @app.post("/orders/")
@@ -364,30 +749,71 @@ async def create_order(order: OrderCreate, db: Session = Depends(get_db), curren
     db.add(db_order)
     db.commit()
     db.refresh(db_order)
-    if redis_available:
-        message = json.dumps({
-            "event": "order_created", 
-            "order_id": db_order.id, 
-            "customer_name": db_order.customer_name,
-            "owner_id": db_order.owner_id,
-            "status": db_order.status
-        })
-        await redis_pool.publish("ops_events", message)
+    await publish_event({
+        "event": "order_created", 
+        "order_id": db_order.id, 
+        "customer_name": db_order.customer_name,
+        "owner_id": db_order.owner_id,
+        "assigned_agent_id": db_order.assigned_agent_id,
+        "status": db_order.status
+    })
     return db_order
 
+def _etag_matches(request: Request, etag: str):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    # Weak comparison: W/"x" and "x" name the same representation
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+async def conditional_list(
+    request: Request, collection: str, current_user: dict, db: Session, load, window_seconds: int = None
+):
+    """
+    ETag / If-None-Match for a polled list endpoint.
+
+    The ETag is the collection's version, which publish_event bumps on every
+    write, plus the caller's view, so an unchanged poll gets a 304 without
+    load(session) running. The version is read before loading, so a write
+    landing in between only makes the tag older than the data. The data must
+    not be older than the tag either: a replica may lag the write behind a
+    recent bump, so within REPLICA_MAX_LAG_SECONDS of one load() gets a
+    primary session instead of db. window_seconds also rolls the tag over on
+    a timer, for data that changes without an event (vehicle positions).
+    """
+    since = collection_versions.now()
+    version = await collection_versions.get(collection)
+    if window_seconds:
+        version = f"{version}.{int(time.time() // window_seconds)}"
+    etag = f'W/"{collection}-{version}-{current_user.get("role")}-{current_user.get("user_id")}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    if replica_engines and await collection_versions.bumped_after(collection, since - REPLICA_MAX_LAG_SECONDS):
+        primary = read_session(use_primary=True)
+        try:
+            return JSONResponse(await load(primary), headers=headers)
+        finally:
+            primary.close()
+    return JSONResponse(await load(db), headers=headers)
+
 @app.get("/orders/")
-def read_orders(
-    db: Session = Depends(get_db),
+async def read_orders(
+    request: Request,
+    db: Session = Depends(get_read_db),
     current_user: dict = Depends(require_role(["admin", "agent", "owner"]))
 ):
     # If user is owner, only return orders belonging to that owner
     user_role = current_user.get("role")
     user_id = current_user.get("user_id")
     
-    if user_role == "owner" and user_id:
-        return db.query(Order).filter(Order.owner_id == user_id).all()
-    # Admin and agent can see all orders
-    return db.query(Order).all()
+    def load(session):
+        if user_role == "owner" and user_id:
+            return jsonable_encoder(session.query(Order).filter(Order.owner_id == user_id).all())
+        # Admin and agent can see all orders
+        return jsonable_encoder(session.query(Order).all())
+    return await conditional_list(request, "orders", current_user, db, lambda session: run_in_threadpool(load, session))
 
 
 @app.patch("/orders/{order_id}/approve")
@@ -426,16 +852,7 @@ async def approve_order(
     db.commit()
     db.refresh(order)
     
-    if redis_available:
-        message = json.dumps({
-            "event": "order_status",
-            "order_id": order_id,
-            "new_status": order.status,
-            "owner_id": order.owner_id,
-            "assigned_agent_id": approval.assigned_agent_id,
-            "old_agent_id": old_agent_id
-        })
-        await redis_pool.publish("ops_events", message)
+    await publish_assignment(order_id, order.status, order.owner_id, approval.assigned_agent_id, old_agent_id)
     return order
 
 @app.patch("/orders/{order_id}/status")
@@ -507,111 +924,768 @@ async def update_order_status(
     db.commit()
     db.refresh(order)
     
-    if redis_available:
-        message = json.dumps({
-            "event": "order_status", 
-            "order_id": order_id, 
-            "new_status": status_update.status,
-            "owner_id": order.owner_id,
-            "assigned_agent_id": order.assigned_agent_id
-        })
-        await redis_pool.publish("ops_events", message)
+    await publish_event({
+        "event": "order_status", 
+        "order_id": order_id, 
+        "new_status": status_update.status,
+        "owner_id": order.owner_id,
+        "assigned_agent_id": order.assigned_agent_id
+    })
     
     return order
 
+async def _send_frame(websocket: WebSocket, payload, encoding: str):
+    kind, data = encode_frame(payload, encoding)
+    if kind == "bytes":
+        await websocket.send_bytes(data)
+    else:
+        await websocket.send_text(data)
+
 @app.websocket("/ws/orders")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, batch_ms: int = 0, encoding: str = "json", token: str = None):
+    """
+    Live ops_events feed.
+    
+    Opt-in options as query parameters:
+    - batch_ms (0-1000): merge events arriving within the window into one
+      {"event": "batch", "events": [...]} frame; a window keeps only the newest
+      location_update per agent.
+    - encoding=msgpack: send MessagePack binary frames instead of JSON text.
+    - token=<JWT>: identify the socket so events targeted at this user
+      (send_to_user) reach it, and so it shows up in /admin/connections.
+    permessage-deflate is negotiated by the server (uvicorn enables it by default)
+    whenever the client offers it.
+    """
+    if encoding not in WS_ENCODINGS or not (0 <= batch_ms <= WS_MAX_BATCH_MS):
+        await websocket.close(code=1008, reason=f"encoding must be one of {', '.join(WS_ENCODINGS)} and batch_ms between 0 and {WS_MAX_BATCH_MS}")
+        return
+    current_user = None
+    if token:
+        try:
+            current_user = get_current_user(token)
+        except HTTPException as e:
+            await websocket.close(code=1008, reason=e.detail)
+            return
     if not redis_available:
         await websocket.close(code=1003, reason="Redis not available")
         return
+    channels = ["ops_events"]
+    if current_user and current_user.get("user_id"):
+        channels.append(user_channel(current_user["user_id"]))
     pubsub = redis_pool.pubsub()
-    await pubsub.subscribe("ops_events")
     try:
-        async for message in pubsub.listen():
-            if message['type'] == 'message':
-                await manager.broadcast(message['data'])
+        # Subscribed before the socket is registered, so a failed subscribe
+        # can't leave a connection in the registry that receives nothing
+        await pubsub.subscribe(*channels)
+        await manager.connect(websocket, current_user)
+        if batch_ms == 0:
+            async for message in pubsub.listen():
+                if message['type'] != 'message':
+                    continue
+                # Each connection has its own subscription, so only send to this socket
+                if encoding == "json":
+                    await websocket.send_text(message['data'])
+                else:
+                    await _send_frame(websocket, json.loads(message['data']), encoding)
+        else:
+            loop = asyncio.get_running_loop()
+            window = batch_ms / 1000
+            batcher = EventBatcher()
+            deadline = None
+            while True:
+                timeout = 1.0 if deadline is None else max(0.0, deadline - loop.time())
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+                if message and message['type'] == 'message':
+                    batcher.add(json.loads(message['data']))
+                    if deadline is None:
+                        # The window opens with the first event, so an idle feed adds no delay
+                        deadline = loop.time() + window
+                if deadline is not None and loop.time() >= deadline:
+                    events = batcher.drain()
+                    deadline = None
+                    if len(events) == 1:
+                        await _send_frame(websocket, events[0], encoding)
+                    elif events:
+                        await _send_frame(websocket, {"event": "batch", "events": events}, encoding)
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
     finally:
-        await pubsub.unsubscribe("ops_events")
+        await manager.disconnect(websocket)
+        await pubsub.unsubscribe(*channels)
         await pubsub.close()
-        
-@app.post("/locations/")
-async def update_location(loc: DriverLocationCreate, db: Session = Depends(get_db), current_user: dict = Depends(require_role(["admin","agent"]))):
-    driver_location = DriverLocation(
-        agent_id=loc.agent_id,
-        latitude=loc.latitude,
-        longitude=loc.longitude
+
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+
+@app.get("/sse/orders")
+async def sse_orders(request: Request, token: str = None):
+    """
+    The /ws/orders feed as Server-Sent Events, for clients behind proxies that
+    break WebSockets. Each ops_events event is one "data:" line of JSON. As
+    with the WebSocket, token=<JWT> (EventSource can't send headers) adds the
+    events targeted at that user. A comment line goes out every
+    SSE_KEEPALIVE_SECONDS so idle proxies don't close the stream.
+    """
+    current_user = get_current_user(token) if token else None
+    if not redis_available:
+        raise HTTPException(status_code=503, detail="Redis not available")
+    channels = ["ops_events"]
+    if current_user and current_user.get("user_id"):
+        channels.append(user_channel(current_user["user_id"]))
+    pubsub = redis_pool.pubsub()
+    await pubsub.subscribe(*channels)
+
+    async def stream():
+        try:
+            # Clients reconnect after this many ms if the stream drops
+            yield "retry: 3000\n\n"
+            loop = asyncio.get_running_loop()
+            last_sent = loop.time()
+            while not await request.is_disconnected():
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=SSE_KEEPALIVE_SECONDS)
+                if message and message["type"] == "message":
+                    yield f"data: {message['data']}\n\n"
+                    last_sent = loop.time()
+                elif loop.time() - last_sent >= SSE_KEEPALIVE_SECONDS:
+                    yield ": keepalive\n\n"
+                    last_sent = loop.time()
+        finally:
+            await pubsub.unsubscribe(*channels)
+            await pubsub.close()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        # X-Accel-Buffering stops nginx from holding events back in its buffer
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    db.add(driver_location)
+
+def _upsert_agent_positions(db: Session, latest):
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(AgentPosition).values([
+        {"agent_id": agent_id, "latitude": latitude, "longitude": longitude, "timestamp": timestamp}
+        for agent_id, (latitude, longitude, timestamp) in latest.items()
+    ])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[AgentPosition.agent_id],
+        set_={"latitude": stmt.excluded.latitude, "longitude": stmt.excluded.longitude, "timestamp": stmt.excluded.timestamp},
+        # A batch that committed late must not move an agent back in time
+        where=AgentPosition.timestamp <= stmt.excluded.timestamp,
+    ))
+
+def persist_locations(db: Session, points):
+    """
+    Write a batch of (agent_id, latitude, longitude, received_at) points, in
+    the order they arrived, in one transaction and move each agent's assigned
+    vehicle and AgentPosition to its newest point.
+    """
+    driver_locations = [
+        DriverLocation(agent_id=agent_id, latitude=latitude, longitude=longitude, timestamp=received_at)
+        for agent_id, latitude, longitude, received_at in points
+    ]
+    db.add_all(driver_locations)
     
+    latest = {
+        agent_id: (latitude, longitude, received_at)
+        for agent_id, latitude, longitude, received_at in sorted(points, key=lambda point: point[3])
+    }
+    _upsert_agent_positions(db, latest)
+
     # Update vehicle location if agent is assigned to a vehicle
-    vehicle = db.query(Vehicle).filter(Vehicle.assigned_agent_id == loc.agent_id).first()
-    if vehicle:
-        vehicle.current_latitude = loc.latitude
-        vehicle.current_longitude = loc.longitude
+    vehicles = db.query(Vehicle).filter(Vehicle.assigned_agent_id.in_(list(latest))).all()
+    for vehicle in vehicles:
+        vehicle.current_latitude, vehicle.current_longitude, _ = latest[vehicle.assigned_agent_id]
     
     db.commit()
+    return driver_locations
+
+async def publish_location(agent_id: int, latitude: float, longitude: float):
+    await publish_event({
+        "event": "location_update",
+        "agent_id": agent_id,
+        "latitude": latitude,
+        "longitude": longitude
+    })
+
+async def admit_location(agent_id: int, latitude: float, longitude: float):
+    """Run a ping through the per-agent admission policy (accept, merge or drop)"""
+    if LOCATION_ADMISSION == "off":
+        return ACCEPT
+    return await location_admission.admit(agent_id, latitude, longitude)
+
+@app.post("/locations/")
+async def update_location(loc: DriverLocationCreate, db: Session = Depends(get_db), current_user: dict = Depends(require_role(["admin","agent"]))):
+    # Any ping counts for presence, even one the admission policy rejects
+    await registry.mark_agent_seen(loc.agent_id)
+    decision = await admit_location(loc.agent_id, loc.latitude, loc.longitude)
+    if decision == DROP:
+        raise HTTPException(status_code=429, detail="Too many location updates; slow down")
+    if decision == MERGE:
+        # Redundant point: nothing is written or broadcast, so there is no
+        # DriverLocation to return; 202 tells the client it was taken but not stored
+        return JSONResponse(
+            {"status": "merged", "agent_id": loc.agent_id, "latitude": loc.latitude, "longitude": loc.longitude},
+            status_code=202,
+        )
+    
+    driver_location = persist_locations(db, [(loc.agent_id, loc.latitude, loc.longitude, datetime.utcnow())])[0]
     db.refresh(driver_location)
-    if redis_available:
-        message = json.dumps({
-            "event": "location_update",
-            "agent_id": loc.agent_id,
-            "latitude": loc.latitude,
-            "longitude": loc.longitude
-        })
-        await redis_pool.publish("ops_events", message)
+    await publish_location(loc.agent_id, loc.latitude, loc.longitude)
     return driver_location
 
+WS_LOCATION_BATCH_SIZE = int(os.getenv("WS_LOCATION_BATCH_SIZE", "20"))
+WS_LOCATION_FLUSH_SECONDS = float(os.getenv("WS_LOCATION_FLUSH_SECONDS", "1.0"))
+
+def _parse_location_frame(frame, current_user: dict, received_at: datetime):
+    """
+    Validate one position frame, returning (seq, agent_id, latitude, longitude, received_at).
+    received_at is when its message arrived, so a point keeps its time however late the batch is written.
+    """
+    if not isinstance(frame, dict):
+        raise ValueError("Frame must be a JSON object")
+    latitude = float(frame["latitude"])
+    longitude = float(frame["longitude"])
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("Coordinates out of range")
+    # Agents can only stream their own position; admins must say which agent
+    if current_user.get("role") == "agent":
+        agent_id = current_user.get("user_id")
+    else:
+        agent_id = int(frame["agent_id"])
+    return frame.get("seq"), agent_id, latitude, longitude, received_at
+
+def _existing_agent_ids(agent_ids):
+    session = SessionLocal()
+    try:
+        return {
+            agent_id for (agent_id,) in
+            session.query(User.id).filter(User.id.in_(list(agent_ids)), User.role == "agent")
+        }
+    finally:
+        session.close()
+
+def _persist_location_batch(points):
+    session = SessionLocal()
+    try:
+        persist_locations(session, points)
+    finally:
+        session.close()
+
+@app.websocket("/ws/locations")
+async def location_stream(websocket: WebSocket, token: str = None):
+    """
+    Persistent channel for agents to stream GPS positions.
+    
+    Authenticate with ?token=<JWT>. Send frames like
+    {"seq": 1, "latitude": 9.03, "longitude": 38.74} (or a JSON list of them);
+    admins must also include "agent_id" of an existing agent. Points are
+    written in batches of WS_LOCATION_BATCH_SIZE or every
+    WS_LOCATION_FLUSH_SECONDS, whichever comes first, and each batch is
+    acknowledged with
+    {"event": "ack", "seq": <last seq>, "count": n, "merged": m, "dropped": d}.
+    A message that can't be used, or a batch that fails to store, gets
+    {"event": "error", ...} instead and the stream carries on.
+    """
+    try:
+        current_user = get_current_user(token)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+    if current_user.get("role") not in ["admin", "agent"]:
+        await websocket.close(code=1008, reason="Access Denied: Requires role(s) admin, agent")
+        return
+    await websocket.accept()
+    # Registered for the fleet-wide view, but not with manager: this socket
+    # speaks the ack protocol and must not receive feed events
+    conn_id = uuid.uuid4().hex
+    await registry.register(conn_id, current_user.get("user_id"), f"{current_user.get('role')}:locations")
+    
+    batch = []
+    last_seq = None
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + WS_LOCATION_FLUSH_SECONDS
+    
+    rejected = {MERGE: 0, DROP: 0}
+    known_agents = set()  # admin-supplied agent ids already checked against users
+    
+    async def flush():
+        nonlocal batch
+        if not batch and not any(rejected.values()):
+            return
+        points, batch = batch, []
+        if points:
+            try:
+                await run_in_threadpool(_persist_location_batch, points)
+            except Exception as e:
+                print(f"Location batch failed: {e}")
+                rejected[MERGE] = rejected[DROP] = 0
+                await websocket.send_json({
+                    "event": "error", "detail": "Could not store locations", "seq": last_seq, "count": len(points),
+                })
+                return
+        for agent_id, latitude, longitude, _ in points:
+            await publish_location(agent_id, latitude, longitude)
+        await websocket.send_json({
+            "event": "ack",
+            "seq": last_seq,
+            "count": len(points),
+            "merged": rejected[MERGE],
+            "dropped": rejected[DROP],
+        })
+        rejected[MERGE] = rejected[DROP] = 0
+    
+    try:
+        while True:
+            try:
+                raw = await asyncio.wait_for(websocket.receive_text(), timeout=max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                await flush()
+                deadline = loop.time() + WS_LOCATION_FLUSH_SECONDS
+                continue
+            received_at = datetime.utcnow()
+            
+            try:
+                payload = json.loads(raw)
+                frames = payload if isinstance(payload, list) else [payload]
+                parsed = [_parse_location_frame(frame, current_user, received_at) for frame in frames]
+            except (ValueError, KeyError, TypeError) as e:
+                await websocket.send_json({"event": "error", "detail": f"Invalid location frame: {e}"})
+                continue
+            if current_user.get("role") != "agent":
+                # One unknown id would fail the whole batch's insert on its foreign key
+                unknown = {agent_id for _, agent_id, _, _, _ in parsed} - known_agents
+                if unknown:
+                    known_agents.update(await run_in_threadpool(_existing_agent_ids, unknown))
+                    unknown -= known_agents
+                if unknown:
+                    await websocket.send_json({
+                        "event": "error",
+                        "detail": f"Unknown agent_id: {', '.join(str(agent_id) for agent_id in sorted(unknown))}",
+                    })
+                    continue
+            for seq, agent_id, latitude, longitude, received_at in parsed:
+                if seq is not None:
+                    last_seq = seq
+                await registry.mark_agent_seen(agent_id)
+                decision = await admit_location(agent_id, latitude, longitude)
+                if decision == ACCEPT:
+                    batch.append((agent_id, latitude, longitude, received_at))
+                else:
+                    rejected[decision] += 1
+            
+            if len(batch) >= WS_LOCATION_BATCH_SIZE:
+                await flush()
+                deadline = loop.time() + WS_LOCATION_FLUSH_SECONDS
+    except WebSocketDisconnect:
+        # Client is gone, so no ack can be sent; still keep what it sent
+        if batch:
+            try:
+                await run_in_threadpool(_persist_location_batch, batch)
+            except Exception as e:
+                print(f"Location batch failed: {e}")
+            else:
+                for agent_id, latitude, longitude, _ in batch:
+                    await publish_location(agent_id, latitude, longitude)
+    finally:
+        await registry.unregister(conn_id)
+
+@app.get("/presence/agents")
+async def get_online_agents(db: Session = Depends(get_read_db), current_user: dict = Depends(require_role(["admin", "owner"]))):
+    """Agents that pinged within PRESENCE_TTL_SECONDS, across all workers, without touching driver_locations"""
+    online = await registry.online_agents()
+    if current_user.get("role") == "owner":
+        owner_id = current_user.get("user_id")
+        agent_ids = set(await cached_read(
+            f"owner_agents:{owner_id}",
+            [f"owner_agents:{owner_id}"],
+            db,
+            lambda session: _owner_agent_ids(session, owner_id),
+        ))
+        online = {agent_id: seen for agent_id, seen in online.items() if agent_id in agent_ids}
+    return {
+        "count": len(online),
+        "agents": [
+            {"agent_id": agent_id, "last_seen": datetime.utcfromtimestamp(seen).isoformat()}
+            for agent_id, seen in sorted(online.items())
+        ],
+    }
+
+@app.get("/admin/connections")
+async def get_connections(current_user: dict = Depends(require_role(["admin"]))):
+    """Live WebSocket connections grouped by worker, as recorded in the shared registry"""
+    workers = await registry.connections()
+    return {
+        "backend": registry.backend,
+        "this_worker": WORKER_ID,
+        "total": sum(len(conns) for conns in workers.values()),
+        "workers": workers,
+    }
+
+@app.get("/eta/")
+async def get_etas(current_user: dict = Depends(require_role(["admin", "owner"]))):
+    """Latest ETA per active order, as last pushed in eta_update events"""
+    if redis_available:
+        etas = [json.loads(raw) for raw in (await redis_pool.hgetall("eta:orders")).values()]
+    else:
+        etas = list(eta_estimator.etas.values())
+    if current_user.get("role") == "owner":
+        etas = [eta for eta in etas if eta["owner_id"] == current_user.get("user_id")]
+    return sorted(etas, key=lambda eta: eta["order_id"])
+
+@app.post("/admin/dispatch/run")
+async def trigger_dispatch(current_user: dict = Depends(require_role(["admin"]))):
+    """Run a dispatch cycle now, whether or not the background dispatcher is enabled"""
+    return await run_dispatch()
+
+@app.get("/admin/dispatch")
+async def get_dispatch_status(current_user: dict = Depends(require_role(["admin"]))):
+    return {
+        "enabled": DISPATCH_ENABLED,
+        "interval_seconds": DISPATCH_INTERVAL_SECONDS,
+        "last_run": last_dispatch,
+    }
+
+@app.get("/admin/locations/admission")
+async def get_location_admission_stats(current_user: dict = Depends(require_role(["admin"]))):
+    """Accepted / merged / dropped ping counts and the agents with the most rejected pings"""
+    stats = await location_admission.stats()
+    stats["mode"] = LOCATION_ADMISSION
+    return stats
+
+@app.get("/admin/db/replicas")
+def get_replica_health(current_user: dict = Depends(require_role(["admin"]))):
+    """Health and replication lag of each read replica, as of the last probe"""
+    return {
+        "replicas": replica_status,
+        "max_lag_seconds": REPLICA_MAX_LAG_SECONDS,
+        "read_your_writes_seconds": READ_YOUR_WRITES_SECONDS,
+    }
+
+class ProfilerStart(BaseModel):
+    fraction: float = 0.1  # share of requests to sample, ignored when route is set
+    route: str = None  # route path template, e.g. "/orders/"; samples every request to it
+    interval_ms: int = None
+    duration_seconds: int = None
+
+@app.post("/admin/profiler/start")
+def start_profiler(settings: ProfilerStart, current_user: dict = Depends(require_role(["admin"]))):
+    """Start sampling live requests in this worker; clears the previous profile"""
+    if not 0 < settings.fraction <= 1:
+        raise HTTPException(status_code=400, detail="fraction must be in (0, 1]")
+    if settings.route is not None and not any(getattr(r, "path", None) == settings.route for r in app.routes):
+        raise HTTPException(status_code=400, detail=f"Unknown route {settings.route}")
+    if settings.interval_ms is not None and settings.interval_ms < 1:
+        raise HTTPException(status_code=400, detail="interval_ms must be at least 1")
+    profiler.reset()
+    profiler.start(settings.fraction, settings.route, settings.interval_ms, settings.duration_seconds)
+    return {"worker": WORKER_ID, **profiler.status()}
+
+@app.post("/admin/profiler/stop")
+def stop_profiler(current_user: dict = Depends(require_role(["admin"]))):
+    profiler.stop()
+    return {"worker": WORKER_ID, **profiler.status()}
+
+@app.get("/admin/profiler")
+def get_profiler_status(current_user: dict = Depends(require_role(["admin"]))):
+    return {"worker": WORKER_ID, **profiler.status()}
+
+@app.get("/admin/profiler/flamegraph")
+def download_flamegraph(current_user: dict = Depends(require_role(["admin"]))):
+    """Aggregated stacks in collapsed format, for flamegraph.pl or speedscope"""
+    filename = f"profile-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.folded"
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/admin/db/pool")
+def get_pool_metrics(current_user: dict = Depends(require_role(["admin"]))):
+    """Connection pool saturation for this worker: checked-out connections, overflow and checkout waits"""
+    return {
+        "worker": WORKER_ID,
+        "threadpool_size": THREADPOOL_SIZE,
+        "primary": pool_metrics(db.engine),
+        "replicas": [pool_metrics(replica) for replica in replica_engines],
+    }
+
 @app.get("/locations/")
-def get_locations(db: Session = Depends(get_db), current_user: dict = Depends(require_role(["admin","owner"]))):
-    # Get latest location for each agent
-    from sqlalchemy import func
-    subquery = db.query(
-        DriverLocation.agent_id,
-        func.max(DriverLocation.timestamp).label('max_timestamp')
-    ).group_by(DriverLocation.agent_id).subquery()
-    
-    latest_locations = db.query(DriverLocation).join(
-        subquery,
-        (DriverLocation.agent_id == subquery.c.agent_id) &
-        (DriverLocation.timestamp == subquery.c.max_timestamp)
+async def get_locations(request: Request, db: Session = Depends(get_read_db), current_user: dict = Depends(require_role(["admin","owner"]))):
+    def load(session):
+        # Latest location for each agent, kept one row per agent by persist_locations
+        return jsonable_encoder(session.query(AgentPosition).all())
+    return await conditional_list(request, "locations", current_user, db, lambda session: run_in_threadpool(load, session))
+
+ORDER_EXPORT_COLUMNS = [
+    "id", "customer_name", "delivery_address", "delivery_latitude", "delivery_longitude",
+    "pickup_address", "pickup_latitude", "pickup_longitude", "status",
+    "assigned_agent_id", "owner_id", "vehicle_id", "created_at", "updated_at",
+]
+LOCATION_EXPORT_COLUMNS = ["id", "agent_id", "latitude", "longitude", "timestamp"]
+
+def _naive_utc(value: datetime):
+    """Query parameter datetime as naive UTC, the way timestamps are stored"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def _export_response(stmt, columns, name, fmt, compress):
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Must be one of: {', '.join(EXPORT_MEDIA_TYPES)}")
+    filename = f"{name}.{fmt}" + (".gz" if compress else "")
+    media_type = "application/gzip" if compress else EXPORT_MEDIA_TYPES[fmt]
+    return StreamingResponse(
+        stream_export(stmt, columns, fmt=fmt, compress=compress),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/export/orders")
+def export_orders(
+    fmt: str = "csv",
+    start: datetime = None,
+    end: datetime = None,
+    owner_id: int = None,
+    agent_id: int = None,
+    gzip: bool = False,
+    current_user: dict = Depends(require_role(["admin", "owner"]))
+):
+    """Stream orders as CSV or NDJSON, filtered by created_at range, owner and agent"""
+    start, end = _naive_utc(start), _naive_utc(end)
+    # Owners can only export their own orders
+    if current_user.get("role") == "owner":
+        owner_id = current_user.get("user_id")
+    
+    stmt = select(*[getattr(Order, col) for col in ORDER_EXPORT_COLUMNS]).order_by(Order.id)
+    if start:
+        stmt = stmt.where(Order.created_at >= start)
+    if end:
+        stmt = stmt.where(Order.created_at < end)
+    if owner_id:
+        stmt = stmt.where(Order.owner_id == owner_id)
+    if agent_id:
+        stmt = stmt.where(Order.assigned_agent_id == agent_id)
+    return _export_response(stmt, ORDER_EXPORT_COLUMNS, "orders", fmt, gzip)
+
+@app.get("/export/locations")
+def export_locations(
+    fmt: str = "csv",
+    start: datetime = None,
+    end: datetime = None,
+    owner_id: int = None,
+    agent_id: int = None,
+    gzip: bool = False,
+    current_user: dict = Depends(require_role(["admin", "owner"]))
+):
+    """Stream driver location history as CSV or NDJSON, filtered by time range, owner and agent"""
+    start, end = _naive_utc(start), _naive_utc(end)
+    # Owners only see agents assigned to their orders
+    if current_user.get("role") == "owner":
+        owner_id = current_user.get("user_id")
+    
+    stmt = select(*[getattr(DriverLocation, col) for col in LOCATION_EXPORT_COLUMNS]).order_by(DriverLocation.id)
+    if start:
+        stmt = stmt.where(DriverLocation.timestamp >= start)
+    if end:
+        stmt = stmt.where(DriverLocation.timestamp < end)
+    if agent_id:
+        stmt = stmt.where(DriverLocation.agent_id == agent_id)
+    if owner_id:
+        owner_agents = select(Order.assigned_agent_id).where(Order.owner_id == owner_id)
+        stmt = stmt.where(DriverLocation.agent_id.in_(owner_agents))
+    return _export_response(stmt, LOCATION_EXPORT_COLUMNS, "driver_locations", fmt, gzip)
+
+TRACK_MAX_WINDOW = timedelta(days=7)
+
+def _build_track(db: Session, agent_id: int, start: datetime, end: datetime, tolerance: float, encoding: str):
+    if encoding not in ("json", "polyline"):
+        raise HTTPException(status_code=400, detail="Invalid encoding. Must be one of: json, polyline")
+    if tolerance < 0:
+        raise HTTPException(status_code=400, detail="tolerance must be zero or positive")
+    end = _naive_utc(end) or datetime.utcnow()
+    start = _naive_utc(start) or end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if end - start > TRACK_MAX_WINDOW:
+        raise HTTPException(status_code=400, detail="Track window cannot exceed 7 days; use /export/locations for longer ranges")
+    
+    # Only the three columns we need, ordered by the (agent_id, timestamp) index
+    rows = db.execute(
+        select(DriverLocation.latitude, DriverLocation.longitude, DriverLocation.timestamp)
+        .where(DriverLocation.agent_id == agent_id)
+        .where(DriverLocation.timestamp >= start)
+        .where(DriverLocation.timestamp < end)
+        # Points of one message share a receive time; ids keep their order
+        .order_by(DriverLocation.timestamp, DriverLocation.id)
     ).all()
+    points = simplify_track(rows, tolerance)
+    
+    track = {
+        "agent_id": agent_id,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "tolerance": tolerance,
+        "raw_points": len(rows),
+        "points": len(points),
+    }
+    if encoding == "polyline":
+        track["polyline"] = encode_polyline(points)
+        track["timestamps"] = [p[2].isoformat() for p in points]
+    else:
+        track["path"] = [
+            {"latitude": p[0], "longitude": p[1], "timestamp": p[2].isoformat()}
+            for p in points
+        ]
+    return track
+
+def _check_track_access(db: Session, current_user: dict, agent_id: int):
+    user_role = current_user.get("role")
+    user_id = current_user.get("user_id")
+    if user_role == "agent" and agent_id != user_id:
+        raise HTTPException(status_code=403, detail="Agents can only view their own track")
+    if user_role == "owner":
+        # Owners only see agents assigned to their orders
+        assigned = db.query(Order.id).filter(Order.owner_id == user_id, Order.assigned_agent_id == agent_id).first()
+        if not assigned:
+            raise HTTPException(status_code=403, detail="Agent is not assigned to any of your orders")
+
+@app.get("/agents/{agent_id}/track")
+def get_agent_track(
+    agent_id: int,
+    start: datetime = None,
+    end: datetime = None,
+    tolerance: float = 10.0,
+    encoding: str = "json",
+    db: Session = Depends(get_read_db),
+    current_user: dict = Depends(require_role(["admin", "owner", "agent"]))
+):
+    """
+    Agent's path over a time window (default: last 24h), simplified server-side.
+    tolerance is in meters (0 disables simplification); encoding=polyline returns
+    a Google encoded polyline plus a parallel list of timestamps.
+    """
+    _check_track_access(db, current_user, agent_id)
+    return _build_track(db, agent_id, start, end, tolerance, encoding)
+
+@app.get("/vehicles/{vehicle_id}/track")
+def get_vehicle_track(
+    vehicle_id: int,
+    start: datetime = None,
+    end: datetime = None,
+    tolerance: float = 10.0,
+    encoding: str = "json",
+    db: Session = Depends(get_read_db),
+    current_user: dict = Depends(require_role(["admin", "owner"]))
+):
+    """Vehicle's path over a time window, taken from its assigned agent's location history"""
+    vehicle = db.query(Vehicle).filter(Vehicle.id == vehicle_id).first()
+    if not vehicle:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    if current_user.get("role") == "owner" and vehicle.owner_id != current_user.get("user_id"):
+        raise HTTPException(status_code=403, detail="You can only view tracks of your own vehicles")
+    if not vehicle.assigned_agent_id:
+        raise HTTPException(status_code=400, detail="Vehicle has no assigned agent")
     
-    return latest_locations
+    track = _build_track(db, vehicle.assigned_agent_id, start, end, tolerance, encoding)
+    track["vehicle_id"] = vehicle_id
+    return track
+
+@app.get("/map/")
+def get_map(
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    zoom: int,
+    layers: str = "agents,vehicles,orders",
+    db: Session = Depends(get_read_db),
+    current_user: dict = Depends(require_role(["admin", "owner"]))
+):
+    """
+    Map markers inside a bounding box. Below CLUSTER_MAX_ZOOM each layer is
+    returned as grid clusters (centroid + count); at high zoom as individual points.
+    """
+    if not (-90 <= south <= north <= 90):
+        raise HTTPException(status_code=400, detail="Invalid latitude bounds: need -90 <= south <= north <= 90")
+    if not (-180 <= west <= east <= 180):
+        raise HTTPException(status_code=400, detail="Invalid longitude bounds: need -180 <= west <= east <= 180 (split viewports crossing the antimeridian)")
+    if not (0 <= zoom <= 22):
+        raise HTTPException(status_code=400, detail="zoom must be between 0 and 22")
+    requested = [layer.strip() for layer in layers.split(",") if layer.strip()]
+    invalid = [layer for layer in requested if layer not in MAP_LAYERS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid layers: {', '.join(invalid)}. Must be one of: {', '.join(MAP_LAYERS)}")
+    
+    # Owners only see their own orders, vehicles and the agents on their orders
+    owner_id = current_user.get("user_id") if current_user.get("role") == "owner" else None
+    return {
+        "zoom": zoom,
+        "layers": {
+            layer: query_layer(db, layer, south, west, north, east, zoom, owner_id=owner_id)
+            for layer in requested
+        },
+    }
+
+def _owner_agent_ids(db: Session, owner_id: int):
+    return [
+        agent_id for (agent_id,) in
+        db.query(Order.assigned_agent_id)
+        .filter(Order.owner_id == owner_id, Order.assigned_agent_id.isnot(None))
+        .distinct()
+        .all()
+    ]
 
 @app.get("/agents/")
-def get_agents(db: Session = Depends(get_db), current_user: dict = Depends(require_role(["admin","owner"]))):
+async def get_agents(db: Session = Depends(get_read_db), current_user: dict = Depends(require_role(["admin","owner"]))):
     """Get agents - owners see agents assigned to their orders, admins see all agents"""
     user_role = current_user.get("role")
     user_id = current_user.get("user_id")
     
+    all_agents = await cached_read(
+        "agents:admin",
+        ["agents"],
+        db,
+        lambda session: session.query(User).filter(User.role == "agent").all(),
+    )
     if user_role == "owner" and user_id:
-        # Get unique agent IDs from owner's orders
-        owner_orders = db.query(Order).filter(Order.owner_id == user_id).all()
-        agent_ids = list(set([o.assigned_agent_id for o in owner_orders if o.assigned_agent_id]))
-        
-        if agent_ids:
-            # Return agents assigned to owner's orders
-            from sqlalchemy import and_
-            return db.query(User).filter(and_(User.id.in_(agent_ids), User.role == "agent")).all()
-        else:
-            return []
+        # Owner view is the cached agent list filtered by the owner->agent membership index
+        agent_ids = set(await cached_read(
+            f"owner_agents:{user_id}",
+            [f"owner_agents:{user_id}"],
+            db,
+            lambda session: _owner_agent_ids(session, user_id),
+        ))
+        return JSONResponse([agent for agent in all_agents if agent["id"] in agent_ids])
     else:
         # Admin sees all agents
-        return db.query(User).filter(User.role == "agent").all()
+        return JSONResponse(all_agents)
 
 @app.get("/vehicles/")
-def get_vehicles(db: Session = Depends(get_db), current_user: dict = Depends(require_role(["admin", "agent", "owner"]))):
+async def get_vehicles(request: Request, db: Session = Depends(get_read_db), current_user: dict = Depends(require_role(["admin", "agent", "owner"]))):
     user_role = current_user.get("role")
     user_id = current_user.get("user_id")
     
     # Owners can only see their own vehicles
     if user_role == "owner" and user_id:
-        return db.query(Vehicle).filter(Vehicle.owner_id == user_id).all()
-    # Admin and agent can see all vehicles
-    return db.query(Vehicle).all()
+        load = lambda session: cached_read(
+            f"vehicles:owner:{user_id}",
+            ["vehicles"],
+            session,
+            lambda session: session.query(Vehicle).filter(Vehicle.owner_id == user_id).all(),
+            ttl=READ_CACHE_VEHICLES_TTL_SECONDS,
+        )
+    else:
+        # Admin and agent can see all vehicles
+        load = lambda session: cached_read(
+            "vehicles:all",
+            ["vehicles"],
+            session,
+            lambda session: session.query(Vehicle).all(),
+            ttl=READ_CACHE_VEHICLES_TTL_SECONDS,
+        )
+    # Positions move without vehicle events, so the tag expires like the cached list does
+    return await conditional_list(request, "vehicles", current_user, db, load, window_seconds=READ_CACHE_VEHICLES_TTL_SECONDS)
 
 @app.post("/vehicles/")
 async def create_vehicle(vehicle_data: VehicleCreate, db: Session = Depends(get_db), current_user: dict = Depends(require_role(["admin", "agent", "owner"]))):
@@ -636,14 +1710,12 @@ async def create_vehicle(vehicle_data: VehicleCreate, db: Session = Depends(get_
     db.refresh(vehicle)
     
     # Broadcast vehicle registration event
-    if redis_available:
-        message = json.dumps({
-            "event": "vehicle_registered",
-            "vehicle_id": vehicle.id,
-            "owner_id": owner_id,
-            "approval_status": approval_status
-        })
-        await redis_pool.publish("ops_events", message)
+    await publish_event({
+        "event": "vehicle_registered",
+        "vehicle_id": vehicle.id,
+        "owner_id": owner_id,
+        "approval_status": approval_status
+    })
     
     return vehicle
 
@@ -676,14 +1748,12 @@ async def approve_vehicle(
     db.refresh(vehicle)
     
     # Broadcast vehicle approval event
-    if redis_available:
-        message = json.dumps({
-            "event": "vehicle_approved",
-            "vehicle_id": vehicle_id,
-            "approval_status": approval.approval_status,
-            "owner_id": vehicle.owner_id
-        })
-        await redis_pool.publish("ops_events", message)
+    await publish_event({
+        "event": "vehicle_approved",
+        "vehicle_id": vehicle_id,
+        "approval_status": approval.approval_status,
+        "owner_id": vehicle.owner_id
+    })
     
     return vehicle
 
@@ -711,5 +1781,12 @@ async def assign_agent_to_vehicle(
     db.commit()
     db.refresh(vehicle)
     
+    await publish_event({
+        "event": "vehicle_agent_assigned",
+        "vehicle_id": vehicle_id,
+        "assigned_agent_id": assignment.assigned_agent_id,
+        "owner_id": vehicle.owner_id
+    })
+    
     return vehicle
 
@@ -0,0 +1,114 @@
+from sqlalchemy import select, func, cast, Integer
+from sqlalchemy.orm import Session
+
+from backend.eta import ACTIVE_ORDER_STATUSES
+from backend.models import Order, Vehicle, AgentPosition
+
+MAP_LAYERS = ("agents", "vehicles", "orders")
+MAP_ORDER_STATUSES = ("pending",) + ACTIVE_ORDER_STATUSES  # delivered orders drop off the map
+CLUSTER_MAX_ZOOM = 14  # at or above this zoom, individual points are returned
+CELLS_PER_TILE = 4  # grid resolution: cells per 256px map tile edge
+MAP_POINT_LIMIT = 2000  # more points than this in the viewport are clustered regardless of zoom
+
+
+def cell_size_deg(zoom):
+    """Grid cell edge in degrees for a web-mercator zoom level"""
+    return 360.0 / (2 ** zoom) / CELLS_PER_TILE
+
+
+def _cell_index(db: Session, column, origin, size):
+    # Values are >= 0 once the bbox filter is applied, so SQLite's truncating
+    # CAST behaves like floor(); Postgres rounds on CAST so use floor() there.
+    offset = (column - origin) / size
+    if db.bind.dialect.name == "sqlite":
+        return cast(offset, Integer)
+    return cast(func.floor(offset), Integer)
+
+
+def _latest_locations():
+    # One row per agent, maintained on write; aggregating driver_locations
+    # here would read every agent's whole history on each map request
+    return select(
+        AgentPosition.agent_id.label("id"),
+        AgentPosition.latitude.label("latitude"),
+        AgentPosition.longitude.label("longitude"),
+        AgentPosition.timestamp.label("timestamp"),
+    ).subquery()
+
+
+def layer_source(layer, owner_id=None):
+    """Subquery exposing id/latitude/longitude (+ layer extras) for a map layer"""
+    if layer == "agents":
+        source = _latest_locations()
+        if owner_id:
+            owner_agents = select(Order.assigned_agent_id).where(Order.owner_id == owner_id)
+            source = select(source).where(source.c.id.in_(owner_agents)).subquery()
+        return source
+    if layer == "vehicles":
+        stmt = select(
+            Vehicle.id.label("id"),
+            Vehicle.current_latitude.label("latitude"),
+            Vehicle.current_longitude.label("longitude"),
+            Vehicle.status.label("status"),
+            Vehicle.assigned_agent_id.label("assigned_agent_id"),
+        ).where(Vehicle.approval_status == "approved")
+        if owner_id:
+            stmt = stmt.where(Vehicle.owner_id == owner_id)
+        return stmt.subquery()
+    stmt = select(
+        Order.id.label("id"),
+        Order.delivery_latitude.label("latitude"),
+        Order.delivery_longitude.label("longitude"),
+        Order.status.label("status"),
+        Order.assigned_agent_id.label("assigned_agent_id"),
+    ).where(Order.status.in_(MAP_ORDER_STATUSES))
+    if owner_id:
+        stmt = stmt.where(Order.owner_id == owner_id)
+    return stmt.subquery()
+
+
+def query_layer(db: Session, layer, south, west, north, east, zoom, owner_id=None):
+    """
+    Points or grid clusters for one layer inside a bounding box.
+
+    The bbox predicate is a range on the (latitude, longitude) indexes, and at
+    low zoom the grouping happens in SQL, so both work and payload scale with
+    the viewport rather than with the number of rows in the table.
+    """
+    source = layer_source(layer, owner_id)
+    in_bbox = (
+        source.c.latitude.between(south, north) &
+        source.c.longitude.between(west, east)
+    )
+
+    if zoom >= CLUSTER_MAX_ZOOM:
+        rows = db.execute(select(source).where(in_bbox).limit(MAP_POINT_LIMIT + 1)).mappings().all()
+        if len(rows) <= MAP_POINT_LIMIT:
+            return {"points": [_point(row) for row in rows]}
+
+    size = cell_size_deg(zoom)
+    cell_y = _cell_index(db, source.c.latitude, south, size).label("cell_y")
+    cell_x = _cell_index(db, source.c.longitude, west, size).label("cell_x")
+    rows = db.execute(
+        select(
+            cell_y,
+            cell_x,
+            func.count().label("count"),
+            func.avg(source.c.latitude).label("latitude"),
+            func.avg(source.c.longitude).label("longitude"),
+        ).where(in_bbox).group_by(cell_y, cell_x)
+    ).all()
+    return {
+        "cell_size": size,
+        "clusters": [
+            {"latitude": row.latitude, "longitude": row.longitude, "count": row.count}
+            for row in rows
+        ],
+    }
+
+
+def _point(row):
+    point = dict(row)
+    if point.get("timestamp") is not None:
+        point["timestamp"] = point["timestamp"].isoformat()
+    return point
@@ -0,0 +1,182 @@
+"""
+Versioned schema migrations for SQLite and Postgres.
+
+Applied versions are recorded in schema_migrations. Every step is written to
+be idempotent (it inspects the live schema first), so databases created by
+the old create_all-on-boot code or the old SQLite migrate_db script converge
+on the same schema. Index builds run with CREATE INDEX CONCURRENTLY on
+Postgres so they don't block writes on large tables.
+"""
+import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from backend.models import Base
+
+MIGRATIONS_LOCK_ID = 74_2001  # pg_advisory_lock key, serializes runners across workers
+
+
+def _create_tables(conn):
+    Base.metadata.create_all(bind=conn)
+
+
+def _add_missing_columns(conn):
+    """Columns added to the models after a table was first created (all nullable)"""
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = CreateColumn(column).compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+            print(f"✅ Added {column.name} column to {table.name} table!")
+
+
+# Indexes for the hot read paths: per-agent location history, owner/status
+# filtered order lists, vehicle lookups by agent/owner, and map bbox queries
+HOT_QUERY_INDEXES = [
+    ("driver_locations", "ix_driver_locations_agent_id_timestamp", ["agent_id", "timestamp"]),
+    ("orders", "ix_orders_owner_id", ["owner_id"]),
+    ("orders", "ix_orders_status", ["status"]),
+    ("orders", "ix_orders_assigned_agent_id", ["assigned_agent_id"]),
+    ("orders", "ix_orders_delivery_lat_lon", ["delivery_latitude", "delivery_longitude"]),
+    ("vehicles", "ix_vehicles_owner_id", ["owner_id"]),
+    ("vehicles", "ix_vehicles_assigned_agent_id", ["assigned_agent_id"]),
+    ("vehicles", "ix_vehicles_current_lat_lon", ["current_latitude", "current_longitude"]),
+]
+
+
+def create_index(conn, table, name, columns):
+    """CREATE INDEX IF NOT EXISTS, concurrently on Postgres (conn must be in autocommit)"""
+    cols = ", ".join(columns)
+    if conn.dialect.name == "postgresql":
+        # A failed concurrent build leaves an INVALID index behind that
+        # IF NOT EXISTS would happily skip, so drop it and build again
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {"name": name}).first()
+        if invalid:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({cols})"))
+    else:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})"))
+
+
+def _create_hot_query_indexes(conn):
+    for table, name, columns in HOT_QUERY_INDEXES:
+        create_index(conn, table, name, columns)
+        print(f"✅ Ensured {name} index on {table}!")
+
+
+def _create_users_role_index(conn):
+    # The agent list filters users by role; found by the query-plan tests
+    create_index(conn, "users", "ix_users_role", ["role"])
+    print("✅ Ensured ix_users_role index on users!")
+
+
+def _create_agent_positions(conn):
+    # Creates only the missing agent_positions table, then seeds it with each
+    # agent's newest driver_locations row (ids grow with time, so MAX(id) is it)
+    Base.metadata.create_all(bind=conn)
+    conn.execute(text(
+        "INSERT INTO agent_positions (agent_id, latitude, longitude, timestamp) "
+        "SELECT d.agent_id, d.latitude, d.longitude, d.timestamp FROM driver_locations d "
+        "JOIN (SELECT MAX(id) AS id FROM driver_locations WHERE agent_id IS NOT NULL GROUP BY agent_id) latest "
+        "ON d.id = latest.id "
+        "WHERE NOT EXISTS (SELECT 1 FROM agent_positions p WHERE p.agent_id = d.agent_id)"
+    ))
+    print("✅ Ensured agent_positions table!")
+
+
+# (version, name, function, transactional). Non-transactional steps run in
+# autocommit mode, which CREATE INDEX CONCURRENTLY requires.
+MIGRATIONS = [
+    (1, "create tables", _create_tables, True),
+    (2, "add missing columns", _add_missing_columns, True),
+    (3, "hot query indexes", _create_hot_query_indexes, False),
+    (4, "users role index", _create_users_role_index, False),
+    (5, "agent positions", _create_agent_positions, True),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _without_statement_timeout(conn):
+    # Index builds and waiting on the migration lock can outlast the
+    # statement_timeout pooled connections are opened with (DB_STATEMENT_TIMEOUT_MS)
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SET statement_timeout = 0"))
+
+
+def _restore_statement_timeout(conn):
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("RESET statement_timeout"))
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def current_version(engine):
+    """Highest applied version, or 0 for an unmigrated database. One cheap query."""
+    with engine.connect() as conn:
+        if not inspect(conn).has_table("schema_migrations"):
+            return 0
+        return conn.execute(text("SELECT MAX(version) FROM schema_migrations")).scalar() or 0
+
+
+def migrate(engine, wait=True):
+    """
+    Apply pending migrations in order; returns the list of versions applied.
+    With wait=False, returns None at once if another process holds the
+    migration lock (Postgres) instead of waiting for it.
+    """
+    applied = []
+    # The lock connection must not sit in an open transaction: CREATE INDEX
+    # CONCURRENTLY waits for every older transaction to finish, including ours
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        is_postgres = lock_conn.dialect.name == "postgresql"
+        if is_postgres:
+            _without_statement_timeout(lock_conn)
+            if wait:
+                lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+            elif not lock_conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": MIGRATIONS_LOCK_ID}).scalar():
+                _restore_statement_timeout(lock_conn)
+                return None
+        try:
+            with engine.begin() as conn:
+                _ensure_version_table(conn)
+                done = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+            for version, name, step, transactional in MIGRATIONS:
+                if version in done:
+                    continue
+                print(f"Applying migration {version}: {name}")
+                if transactional:
+                    with engine.begin() as conn:
+                        if is_postgres:
+                            conn.execute(text("SET LOCAL statement_timeout = 0"))
+                        step(conn)
+                else:
+                    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                        _without_statement_timeout(conn)
+                        try:
+                            step(conn)
+                        finally:
+                            _restore_statement_timeout(conn)
+                with engine.begin() as conn:
+                    conn.execute(
+                        text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                        {"v": version, "n": name, "t": datetime.datetime.utcnow()},
+                    )
+                applied.append(version)
+        finally:
+            if is_postgres:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+                _restore_statement_timeout(lock_conn)
+    return applied
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 import datetime
@@ -11,7 +11,7 @@ class User(Base):
     name = Column(String, index=True)
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
-    role = Column(String)  # "admin", "agent", "owner"
+    role = Column(String, index=True)  # "admin", "agent", "owner"
     phone = Column(String)  # phone number for agents
 
 class Order(Base):
@@ -24,9 +24,9 @@ class Order(Base):
     pickup_address = Column(String, nullable=True)  # Optional pickup address
     pickup_latitude = Column(Float, nullable=True)  # Pickup location coordinates
     pickup_longitude = Column(Float, nullable=True)
-    status = Column(String, default="pending")# "pending", "approved", "picked_up", "in_transit", "delivered"
-    assigned_agent_id = Column(Integer, ForeignKey('users.id'))
-    owner_id = Column(Integer, ForeignKey('users.id'), nullable=True)  # Owner who created/manages this order
+    status = Column(String, default="pending", index=True)# "pending", "approved", "picked_up", "in_transit", "delivered"
+    assigned_agent_id = Column(Integer, ForeignKey('users.id'), index=True)
+    owner_id = Column(Integer, ForeignKey('users.id'), nullable=True, index=True)  # Owner who created/manages this order
     vehicle_id = Column(Integer, ForeignKey('vehicles.id'), nullable=True)  # Vehicle assigned to order
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
@@ -35,6 +35,11 @@ class Order(Base):
     owner = relationship("User", foreign_keys=[owner_id])
     vehicle = relationship("Vehicle")
 
+    __table_args__ = (
+        # Map viewport queries filter on a lat/lon bounding box
+        Index("ix_orders_delivery_lat_lon", "delivery_latitude", "delivery_longitude"),
+    )
+
 class Vehicle(Base):
     __tablename__ = "vehicles"
     id = Column(Integer, primary_key=True, index=True)
@@ -43,8 +48,8 @@ class Vehicle(Base):
     vehicle_type = Column(String)  # "truck", "van", "car", etc.
     status = Column(String, default="available")  # "available", "in_use", "maintenance"
     approval_status = Column(String, default="pending")  # "pending", "approved", "rejected"
-    owner_id = Column(Integer, ForeignKey('users.id'), nullable=True)  # Owner who registered the vehicle
-    assigned_agent_id = Column(Integer, ForeignKey('users.id'), nullable=True)  # Agent assigned to vehicle
+    owner_id = Column(Integer, ForeignKey('users.id'), nullable=True, index=True)  # Owner who registered the vehicle
+    assigned_agent_id = Column(Integer, ForeignKey('users.id'), nullable=True, index=True)  # Agent assigned to vehicle
     current_latitude = Column(Float, nullable=True)  # Current vehicle location
     current_longitude = Column(Float, nullable=True)  # Current vehicle location
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -53,6 +58,10 @@ class Vehicle(Base):
     owner = relationship("User", foreign_keys=[owner_id])
     assigned_agent = relationship("User", foreign_keys=[assigned_agent_id])
 
+    __table_args__ = (
+        Index("ix_vehicles_current_lat_lon", "current_latitude", "current_longitude"),
+    )
+
 class DriverLocation(Base):
     __tablename__ = "driver_locations"
     id = Column(Integer, primary_key=True, index=True)
@@ -61,4 +70,21 @@ class DriverLocation(Base):
     longitude = Column(Float)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
 
-    agent = relationship("User")
\ No newline at end of file
+    agent = relationship("User")
+
+    __table_args__ = (
+        # Track and latest-location queries range-scan one agent's history by time
+        Index("ix_driver_locations_agent_id_timestamp", "agent_id", "timestamp"),
+    )
+
+class AgentPosition(Base):
+    """Each agent's newest position, kept by persist_locations so maps never aggregate the history"""
+    __tablename__ = "agent_positions"
+    agent_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_agent_positions_lat_lon", "latitude", "longitude"),
+    )
@@ -0,0 +1,120 @@
+import os
+import socket
+import time
+import uuid
+
+PRESENCE_TTL_SECONDS = int(os.getenv("PRESENCE_TTL_SECONDS", "120"))  # agent counts as online this long after a ping
+WS_HEARTBEAT_SECONDS = int(os.getenv("WS_HEARTBEAT_SECONDS", "15"))
+WORKER_TTL_SECONDS = WS_HEARTBEAT_SECONDS * 3  # a worker that missed three heartbeats is presumed dead
+PRESENCE_WRITE_INTERVAL_SECONDS = 5  # skip presence writes for agents marked more recently than this
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def user_channel(user_id):
+    """Pub/sub channel carrying events targeted at one user, whichever worker holds their socket"""
+    return f"user_events:{user_id}"
+
+
+class LocalRegistry:
+    """Single-process stand-in for RedisRegistry, used when Redis is unavailable"""
+
+    backend = "memory"
+
+    def __init__(self):
+        self._connections = {}  # conn_id -> {"user_id", "role", "connected_at"}
+        self._agents_seen = {}  # agent_id -> last seen (unix time)
+
+    async def register(self, conn_id, user_id, role):
+        self._connections[conn_id] = {"user_id": user_id, "role": role, "connected_at": time.time()}
+
+    async def unregister(self, conn_id):
+        self._connections.pop(conn_id, None)
+
+    async def heartbeat(self):
+        pass
+
+    async def mark_agent_seen(self, agent_id):
+        self._agents_seen[agent_id] = time.time()
+
+    async def online_agents(self):
+        cutoff = time.time() - PRESENCE_TTL_SECONDS
+        return {agent_id: seen for agent_id, seen in self._agents_seen.items() if seen >= cutoff}
+
+    async def connections(self):
+        return {WORKER_ID: list(self._connections.values())}
+
+    async def close(self):
+        self._connections.clear()
+
+
+class RedisRegistry:
+    """
+    Live socket registry and agent presence shared by all workers.
+
+    Each worker keeps its sockets in its own hash, whose TTL the heartbeat
+    refreshes, so a crashed worker's entries disappear on their own. Agent
+    presence is a sorted set scored by last-seen time.
+    """
+
+    backend = "redis"
+    workers_key = "ws:workers"
+    presence_key = "presence:agents"
+
+    def __init__(self, redis_pool):
+        self.redis = redis_pool
+        self.connections_key = f"ws:connections:{WORKER_ID}"
+        self._last_marked = {}  # agent_id -> last presence write from this worker
+
+    async def register(self, conn_id, user_id, role):
+        pipe = self.redis.pipeline()
+        pipe.hset(self.connections_key, conn_id, f"{user_id or ''}|{role or ''}|{time.time()}")
+        pipe.expire(self.connections_key, WORKER_TTL_SECONDS)
+        pipe.zadd(self.workers_key, {WORKER_ID: time.time()})
+        await pipe.execute()
+
+    async def unregister(self, conn_id):
+        await self.redis.hdel(self.connections_key, conn_id)
+
+    async def heartbeat(self):
+        now = time.time()
+        pipe = self.redis.pipeline()
+        pipe.zadd(self.workers_key, {WORKER_ID: now})
+        pipe.expire(self.connections_key, WORKER_TTL_SECONDS)
+        pipe.zremrangebyscore(self.workers_key, 0, now - WORKER_TTL_SECONDS)
+        pipe.zremrangebyscore(self.presence_key, 0, now - PRESENCE_TTL_SECONDS)
+        await pipe.execute()
+
+    async def mark_agent_seen(self, agent_id):
+        now = time.time()
+        if now - self._last_marked.get(agent_id, 0) < PRESENCE_WRITE_INTERVAL_SECONDS:
+            return
+        self._last_marked[agent_id] = now
+        await self.redis.zadd(self.presence_key, {str(agent_id): now})
+
+    async def online_agents(self):
+        cutoff = time.time() - PRESENCE_TTL_SECONDS
+        members = await self.redis.zrangebyscore(self.presence_key, cutoff, "+inf", withscores=True)
+        return {int(agent_id): seen for agent_id, seen in members}
+
+    async def connections(self):
+        cutoff = time.time() - WORKER_TTL_SECONDS
+        workers = await self.redis.zrangebyscore(self.workers_key, cutoff, "+inf")
+        result = {}
+        for worker in workers:
+            entries = await self.redis.hgetall(f"ws:connections:{worker}")
+            result[worker] = []
+            for value in entries.values():
+                user_id, role, connected_at = value.split("|")
+                result[worker].append({
+                    "user_id": int(user_id) if user_id else None,
+                    "role": role or None,
+                    "connected_at": float(connected_at),
+                })
+        return result
+
+    async def close(self):
+        pipe = self.redis.pipeline()
+        pipe.delete(self.connections_key)
+        pipe.zrem(self.workers_key, WORKER_ID)
+        await pipe.execute()
@@ -0,0 +1,240 @@
+"""
+Statistical sampling profiler for live requests.
+
+While enabled, a background thread wakes every interval and snapshots the
+stacks of all threads (sys._current_frames). A stack is kept only if it
+belongs to a sampled request: on the event loop thread that means it runs
+through the request's ProfilerMiddleware frame, so async handlers are only
+charged for time they actually hold the loop; on threadpool workers it means
+it runs through the endpoint of a sampled sync route, or through work a
+sampled async handler handed to SamplingProfiler.run_in_threadpool. Kept
+stacks are aggregated in the collapsed format flamegraph.pl and speedscope read.
+
+Disabled, the middleware is a single attribute check and no thread runs.
+"""
+import contextvars
+import functools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILER_INTERVAL_MS = int(os.getenv("PROFILER_INTERVAL_MS", "10"))
+PROFILER_MAX_SECONDS = int(os.getenv("PROFILER_MAX_SECONDS", "600"))  # sessions stop on their own after this
+PROFILER_MAX_STACKS = 20000  # distinct stacks kept; rarer ones beyond this are counted as dropped
+
+# Label of the sampled request the current task serves, set by ProfilerMiddleware
+_sampled_request = contextvars.ContextVar("sampled_request", default=None)
+
+
+def _frame_label(code):
+    filename = code.co_filename
+    if "site-packages" in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[-1]
+    elif os.sep + "backend" + os.sep in filename:
+        filename = "backend" + os.sep + filename.split(os.sep + "backend" + os.sep, 1)[-1]
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self.active = False
+        self.fraction = 0.0
+        self.route = None
+        self.interval = PROFILER_INTERVAL_MS / 1000
+        self.started_at = None
+        self.stops_at = None
+        self.requests_sampled = 0
+        self.samples = 0
+        self.dropped = 0
+        self.stacks = Counter()
+        self._frames = {}  # request frame on the loop thread -> label
+        self._codes = Counter()  # sync endpoint code in flight -> number of sampled requests
+        self._labels = {}  # sync endpoint code -> label
+        self._threads = {}  # worker thread ident -> label, while it runs a sampled request's work
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, fraction=1.0, route=None, interval_ms=None, duration_seconds=None):
+        self.stop()
+        self.fraction = fraction
+        self.route = route
+        self.interval = (interval_ms or PROFILER_INTERVAL_MS) / 1000
+        self.started_at = time.time()
+        self.stops_at = time.monotonic() + min(duration_seconds or PROFILER_MAX_SECONDS, PROFILER_MAX_SECONDS)
+        self.active = True
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.active = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self.stacks = Counter()
+            self.requests_sampled = 0
+            self.samples = 0
+            self.dropped = 0
+
+    def should_sample(self, route_path):
+        if self.route is not None:
+            return route_path == self.route
+        return random.random() < self.fraction
+
+    def begin(self, frame, label, sync_code=None):
+        with self._lock:
+            self.requests_sampled += 1
+            self._frames[frame] = label
+            if sync_code is not None:
+                self._codes[sync_code] += 1
+                self._labels[sync_code] = label
+
+    def end(self, frame, sync_code=None):
+        with self._lock:
+            self._frames.pop(frame, None)
+            if sync_code is not None:
+                self._codes[sync_code] -= 1
+                if self._codes[sync_code] <= 0:
+                    del self._codes[sync_code]
+
+    async def run_in_threadpool(self, func, *args, **kwargs):
+        """starlette's run_in_threadpool, with the worker's stacks charged to the sampled request"""
+        from starlette.concurrency import run_in_threadpool
+
+        label = _sampled_request.get()
+        if label is None:
+            return await run_in_threadpool(func, *args, **kwargs)
+        return await run_in_threadpool(self._run_traced, label, functools.partial(func, *args, **kwargs))
+
+    def _run_traced(self, label, call):
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._threads[thread_id] = label
+        try:
+            return call()
+        finally:
+            with self._lock:
+                self._threads.pop(thread_id, None)
+
+    def _sample(self):
+        me = threading.get_ident()
+        with self._lock:
+            frames, codes, labels = dict(self._frames), set(self._codes), dict(self._labels)
+            threads = dict(self._threads)
+        if not frames and not codes and not threads:
+            return
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            stack = []
+            label = None
+            pool_label = threads.get(thread_id)
+            while frame is not None:
+                stack.append(frame.f_code)
+                if pool_label is not None and frame.f_code is _RUN_TRACED_CODE:
+                    label = pool_label
+                    break
+                if frame in frames:
+                    label = frames[frame]
+                    break
+                if frame.f_code in codes:
+                    label = labels[frame.f_code]
+                    break
+                frame = frame.f_back
+            if label is None:
+                continue
+            key = ";".join([label] + [_frame_label(code) for code in reversed(stack)])
+            with self._lock:
+                self.samples += 1
+                if key in self.stacks or len(self.stacks) < PROFILER_MAX_STACKS:
+                    self.stacks[key] += 1
+                else:
+                    self.dropped += 1
+
+    def _run(self):
+        while self.active:
+            if time.monotonic() >= self.stops_at:
+                self.active = False
+                break
+            self._sample()
+            time.sleep(self.interval)
+
+    def collapsed(self):
+        """Aggregated stacks, one 'frame;frame;frame count' line each"""
+        with self._lock:
+            lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def status(self):
+        return {
+            "active": self.active,
+            "fraction": self.fraction if self.route is None else None,
+            "route": self.route,
+            "interval_ms": round(self.interval * 1000),
+            "started_at": self.started_at,
+            "seconds_left": max(0, round(self.stops_at - time.monotonic())) if self.active else 0,
+            "requests_sampled": self.requests_sampled,
+            "samples": self.samples,
+            "distinct_stacks": len(self.stacks),
+            "dropped_samples": self.dropped,
+        }
+
+
+_RUN_TRACED_CODE = SamplingProfiler._run_traced.__code__
+
+
+class ProfilerMiddleware:
+    """
+    Pure ASGI middleware (BaseHTTPMiddleware would cost every request a task
+    even while profiling is off). Add it before any other middleware so it is
+    innermost and runs in the same task as the endpoint.
+    """
+
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if not self.profiler.active or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        route = self._match_route(scope)
+        route_path = getattr(route, "path", None)
+        if route_path is None or not self.profiler.should_sample(route_path):
+            return await self.app(scope, receive, send)
+        await self._profiled(scope, receive, send, route)
+
+    def _match_route(self, scope):
+        from starlette.routing import Match
+
+        router = scope["app"].router
+        for route in router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route
+        return None
+
+    async def _profiled(self, scope, receive, send, route):
+        import inspect
+
+        frame = sys._getframe()
+        endpoint = getattr(route, "endpoint", None)
+        # Sync endpoints run in the threadpool, away from this frame
+        sync_code = None
+        if endpoint is not None and not inspect.iscoroutinefunction(endpoint):
+            sync_code = getattr(endpoint, "__code__", None)
+        label = f"{scope['method']} {route.path}"
+        self.profiler.begin(frame, label, sync_code)
+        # Seen by the endpoint's task, so its threadpool work can be attributed
+        token = _sampled_request.set(label)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _sampled_request.reset(token)
+            self.profiler.end(frame, sync_code)
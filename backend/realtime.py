@@ -0,0 +1,45 @@
+import json
+
+WS_ENCODINGS = ("json", "msgpack")
+WS_MAX_BATCH_MS = 1000
+
+
+class EventBatcher:
+    """
+    Collects ops_events for one connection during a batching window.
+
+    A location_update replaces any earlier, not yet sent update for the same
+    agent, so a window only ever carries each agent's newest position.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._location_index = {}  # agent_id -> position in self.events
+        self.superseded = 0
+
+    def __len__(self):
+        return len(self.events) - self.superseded
+
+    def add(self, event: dict):
+        if event.get("event") == "location_update" and event.get("agent_id") is not None:
+            previous = self._location_index.get(event["agent_id"])
+            if previous is not None:
+                self.events[previous] = None
+                self.superseded += 1
+            self._location_index[event["agent_id"]] = len(self.events)
+        self.events.append(event)
+
+    def drain(self):
+        events = [event for event in self.events if event is not None]
+        self.events = []
+        self._location_index = {}
+        self.superseded = 0
+        return events
+
+
+def encode_frame(payload, encoding):
+    """(kind, data) for websocket.send: text JSON or binary MessagePack"""
+    if encoding == "msgpack":
+        import msgpack
+        return "bytes", msgpack.packb(payload, use_bin_type=True)
+    return "text", json.dumps(payload, separators=(",", ":"))
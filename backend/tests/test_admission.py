@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import pytest
+
+from backend import main
+from backend.admission import LocationAdmission, RedisLocationAdmission, ACCEPT, MERGE, DROP
+
+
+def test_token_bucket_drops_bursts():
+    admission = LocationAdmission(rate=1, burst=3, min_interval=0, min_distance=0)
+    decisions = [admission.check(1, 9.0 + i * 0.01, 38.7, now=i * 0.01) for i in range(5)]
+    assert decisions == [ACCEPT, ACCEPT, ACCEPT, DROP, DROP]
+    # Bucket refills at the configured rate
+    assert admission.check(1, 9.5, 38.7, now=2.0) == ACCEPT
+
+def test_min_interval_merges_rapid_pings():
+    admission = LocationAdmission(rate=100, burst=100, min_interval=1.0, min_distance=0)
+    assert admission.check(1, 9.0, 38.7, now=0.0) == ACCEPT
+    assert admission.check(1, 9.1, 38.7, now=0.5) == MERGE
+    assert admission.check(1, 9.1, 38.7, now=1.5) == ACCEPT
+
+def test_min_distance_merges_stationary_agent_until_max_interval():
+    admission = LocationAdmission(rate=100, burst=100, min_interval=0, min_distance=5, max_interval=60)
+    assert admission.check(1, 9.0, 38.7, now=0.0) == ACCEPT
+    assert admission.check(1, 9.00001, 38.7, now=10.0) == MERGE
+    assert admission.check(1, 9.00001, 38.7, now=61.0) == ACCEPT
+
+def test_agents_are_independent_and_counted():
+    admission = LocationAdmission(rate=1, burst=1, min_interval=0, min_distance=0)
+    assert admission.check(1, 9.0, 38.7, now=0.0) == ACCEPT
+    assert admission.check(1, 9.1, 38.7, now=0.0) == DROP
+    assert admission.check(2, 9.0, 38.7, now=0.0) == ACCEPT
+    assert admission._counts == {ACCEPT: 2, DROP: 1}
+
+def test_idle_agents_are_forgotten_after_ttl():
+    admission = LocationAdmission(rate=1, burst=1, min_interval=0, min_distance=0, ttl=100)
+    admission.check(1, 9.0, 38.7, now=0.0)
+    admission.check(2, 9.0, 38.7, now=50.0)
+    admission.check(1, 9.1, 38.7, now=60.0)
+    admission.check(3, 9.0, 38.7, now=155.0)
+    # Agent 2 went quiet at 50; agent 1 pinged again at 60
+    assert list(admission._state) == [1, 3] and set(admission._agent_counts) == {1, 3}
+    admission.check(3, 9.1, 38.7, now=170.0)
+    assert list(admission._state) == [3]
+    # Back after expiry: a fresh bucket
+    assert admission.check(1, 9.2, 38.7, now=170.0) == ACCEPT
+
+def _redis_admission():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # fakeredis runs Lua scripts through lupa
+    return RedisLocationAdmission(fakeredis.FakeAsyncRedis(decode_responses=True),
+                                  rate=1, burst=1, min_interval=0, min_distance=0)
+
+@pytest.mark.parametrize("make", [
+    lambda: LocationAdmission(rate=1, burst=1, min_interval=0, min_distance=0),
+    _redis_admission,
+], ids=["memory", "redis"])
+def test_stats_report_the_same_fields_per_backend(make):
+    async def run():
+        admission = make()
+        for agent_id, lat in ((1, 9.0), (1, 9.1), (1, 9.2), (2, 9.0), (2, 9.1), (3, 9.0)):
+            await admission.admit(agent_id, lat, 38.7)
+        return await admission.stats(top=2)
+
+    stats = asyncio.run(run())
+    assert (stats["accepted"], stats["merged"], stats["dropped"]) == (3, 0, 3)
+    assert stats["top_agents"] == [
+        {"agent_id": 1, "accepted": 1, "merged": 0, "dropped": 2},
+        {"agent_id": 2, "accepted": 1, "merged": 0, "dropped": 1},
+    ]
+
+def test_merged_ping_is_accepted_without_a_location(monkeypatch):
+    admission = LocationAdmission(rate=100, burst=100, min_interval=60, min_distance=0)
+    admission.check(7, 9.0, 38.7)
+    monkeypatch.setattr(main, "location_admission", admission)
+    monkeypatch.setattr(main, "LOCATION_ADMISSION", "auto")
+    loc = main.DriverLocationCreate(agent_id=7, latitude=9.0, longitude=38.7)
+    response = asyncio.run(main.update_location(loc=loc, db=None, current_user={"role": "agent", "user_id": 7}))
+    assert response.status_code == 202
+    assert json.loads(response.body) == {"status": "merged", "agent_id": 7, "latitude": 9.0, "longitude": 38.7}
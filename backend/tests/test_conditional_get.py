@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.requests import Request
+
+from backend import main
+from backend.cache import MemoryCollectionVersions
+from backend.main import _etag_matches
+from backend.models import Base, Order
+
+
+def _request(if_none_match):
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": [(b"if-none-match", if_none_match.encode())]})
+
+def test_versions_bump_per_collection():
+    versions = MemoryCollectionVersions()
+    orders, vehicles = asyncio.run(versions.get("orders")), asyncio.run(versions.get("vehicles"))
+    asyncio.run(versions.bump(["orders"]))
+    assert asyncio.run(versions.get("orders")) != orders
+    assert asyncio.run(versions.get("vehicles")) == vehicles
+
+def test_versions_differ_between_processes():
+    # A fresh counter (another worker, or after a restart) must not reuse tags
+    assert asyncio.run(MemoryCollectionVersions().get("orders")) != asyncio.run(MemoryCollectionVersions().get("orders"))
+
+def test_etag_matching():
+    etag = 'W/"orders-1-admin-1"'
+    assert _etag_matches(_request(etag), etag)
+    assert _etag_matches(_request('"other", "orders-1-admin-1"'), etag)
+    assert _etag_matches(_request("*"), etag)
+    assert not _etag_matches(_request('W/"orders-2-admin-1"'), etag)
+
+@pytest.fixture
+def lagging_replica(tmp_path, monkeypatch):
+    """Primary and replica SQLite databases; the replica is missing the newest order"""
+    engines = {}
+    for name, orders in (("primary", 2), ("replica", 1)):
+        engines[name] = create_engine(f"sqlite:///{tmp_path / name}.db")
+        Base.metadata.create_all(bind=engines[name])
+        with engines[name].begin() as conn:
+            conn.execute(Order.__table__.insert(), [
+                {"customer_name": f"customer {i}", "delivery_address": f"{i} Main St", "status": "pending", "owner_id": 1}
+                for i in range(orders)
+            ])
+    Session = sessionmaker(autoflush=False)
+    monkeypatch.setattr(main, "replica_engines", [engines["replica"]])
+    monkeypatch.setattr(main, "read_session", lambda use_primary=False: Session(bind=engines["primary" if use_primary else "replica"]))
+    monkeypatch.setattr(main, "collection_versions", MemoryCollectionVersions())
+    db = Session(bind=engines["replica"])
+    yield db
+    db.close()
+    for engine in engines.values():
+        engine.dispose()
+
+def _read_orders(db, if_none_match=""):
+    request = _request(if_none_match)
+    return asyncio.run(main.read_orders(request=request, db=db, current_user={"role": "admin", "user_id": 1}))
+
+def test_recent_write_loads_from_primary(lagging_replica):
+    # Quiet collection: the replica is trusted
+    assert len(json.loads(_read_orders(lagging_replica).body)) == 1
+    asyncio.run(main.collection_versions.bump(["orders"]))
+    # Just written: the new tag must come with data that has the write
+    response = _read_orders(lagging_replica)
+    assert len(json.loads(response.body)) == 2
+    assert _read_orders(lagging_replica, response.headers["etag"]).status_code == 304
+
+def test_replica_is_used_once_the_lag_window_passed(lagging_replica, monkeypatch):
+    asyncio.run(main.collection_versions.bump(["orders"]))
+    monkeypatch.setattr(main, "REPLICA_MAX_LAG_SECONDS", -1)
+    assert len(json.loads(_read_orders(lagging_replica).body)) == 1
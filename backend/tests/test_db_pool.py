@@ -0,0 +1,31 @@
+import pytest
+from sqlalchemy import create_engine, exc
+
+from backend.db import MeteredQueuePool, pool_metrics
+
+
+def test_pool_metrics_report_saturation_and_timeouts(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=MeteredQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    held = engine.connect()
+    try:
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+        metrics = pool_metrics(engine)
+        assert metrics["checked_out"] == 1
+        assert metrics["checkouts"] == 2
+        assert metrics["checkout_timeouts"] == 1
+        assert metrics["wait_max_ms"] >= 50
+    finally:
+        held.close()
+    assert pool_metrics(engine)["checked_out"] == 0
+    engine.dispose()
+
+def test_pool_metrics_without_queue_pool():
+    engine = create_engine("sqlite:///:memory:")
+    assert pool_metrics(engine) == {"url": "sqlite:///:memory:", "pool": "SingletonThreadPool"}
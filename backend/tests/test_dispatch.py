@@ -0,0 +1,168 @@
+import asyncio
+import datetime
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import dispatch
+from backend.models import Base, User, Vehicle, DriverLocation, Order
+from backend.dispatch import assign, cost_matrix, _assign_greedy
+
+NOW = datetime.datetime.utcnow()
+
+
+def test_cost_matrix_adds_load_and_cuts_off_far_agents():
+    cost = cost_matrix([38.70], [-9.14], [38.70, 38.71, 41.15], [-9.14, -9.14, -8.61], [2, 0, 0])
+    assert cost.shape == (1, 3)
+    assert cost[0, 0] == pytest.approx(2 * dispatch.DISPATCH_LOAD_COST_M)
+    assert cost[0, 1] == pytest.approx(1112, rel=0.01)
+    assert np.isinf(cost[0, 2])  # ~270 km away
+
+def test_greedy_respects_capacity_and_prefers_nearest():
+    cost = np.array([[1.0, 5.0], [2.0, 6.0], [3.0, 4.0]])
+    assignment = _assign_greedy(cost, np.array([1, 5]))
+    # Agent 0 has room for one order and keeps the cheapest
+    assert assignment.tolist() == [0, 1, 1]
+
+def test_greedy_leaves_unreachable_orders_unassigned():
+    cost = np.array([[np.inf, np.inf], [1.0, np.inf]])
+    assert _assign_greedy(cost, np.array([2, 2])).tolist() == [-1, 0]
+
+def test_assign_with_no_capacity():
+    assert assign(np.ones((2, 2)), [0, 0]).tolist() == [-1, -1]
+
+def test_greedy_handles_thousands_of_orders():
+    rnd = np.random.default_rng(1)
+    orders, agents = 5000, 1000
+    cost = cost_matrix(
+        38.6 + rnd.random(orders) * 0.3, -9.3 + rnd.random(orders) * 0.3,
+        38.6 + rnd.random(agents) * 0.3, -9.3 + rnd.random(agents) * 0.3,
+        rnd.integers(0, 3, agents),
+    )
+    capacity = np.full(agents, 5)
+    assignment = _assign_greedy(cost, capacity)
+    assert (assignment >= 0).all()
+    assert np.bincount(assignment, minlength=agents).max() <= 5
+
+def test_optimal_beats_or_matches_greedy():
+    pytest.importorskip("scipy")
+    rnd = np.random.default_rng(2)
+    cost = rnd.random((40, 10)) * 1000
+    capacity = np.full(10, 4)
+    total = lambda a: sum(cost[i, j] for i, j in enumerate(a) if j >= 0)
+    optimal = dispatch._assign_optimal(cost, capacity)
+    assert (optimal >= 0).all()
+    assert total(optimal) <= total(_assign_greedy(cost, capacity)) + 1e-6
+
+
+
+@pytest.fixture
+def Session(tmp_path, monkeypatch):
+    """SQLite database with three agents: two ready, one with a stale position"""
+    monkeypatch.setattr(dispatch, "DISPATCH_MAX_ORDERS_PER_AGENT", 2)
+    engine = create_engine(f"sqlite:///{tmp_path / 'dispatch.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    stale = NOW - datetime.timedelta(seconds=dispatch.DISPATCH_LOCATION_MAX_AGE_SECONDS + 60)
+    with Session() as db:
+        db.add(User(id=1, email="owner@example.com", role="owner"))
+        for agent_id, lat, seen in [(10, 38.70, NOW), (11, 38.80, NOW), (12, 38.71, stale)]:
+            db.add(User(id=agent_id, email=f"agent{agent_id}@example.com", role="agent"))
+            db.add(Vehicle(license_plate=f"P{agent_id}", assigned_agent_id=agent_id,
+                           approval_status="approved", status="available"))
+            db.add(DriverLocation(agent_id=agent_id, latitude=lat, longitude=-9.14, timestamp=seen))
+        # Agent 10 already carries one order, so it has room for one more
+        db.add(Order(customer_name="busy", delivery_address="x", status="approved", assigned_agent_id=10,
+                     owner_id=1, delivery_latitude=38.70, delivery_longitude=-9.14, created_at=NOW))
+        db.commit()
+    yield Session
+    engine.dispose()
+
+
+def _add_orders(Session, points):
+    """Pending orders, oldest first, from ((pickup lat, lon), (delivery lat, lon)) pairs"""
+    ids = []
+    with Session() as db:
+        for i, ((pickup_lat, pickup_lon), (delivery_lat, delivery_lon)) in enumerate(points):
+            order = Order(customer_name=f"c{i}", delivery_address="x", status="pending", owner_id=1,
+                          pickup_latitude=pickup_lat, pickup_longitude=pickup_lon,
+                          delivery_latitude=delivery_lat, delivery_longitude=delivery_lon,
+                          created_at=NOW + datetime.timedelta(seconds=i))
+            db.add(order)
+            db.flush()
+            ids.append(order.id)
+        db.commit()
+    return ids
+
+def _statuses(Session, ids):
+    with Session() as db:
+        return {o.id: (o.status, o.assigned_agent_id) for o in db.query(Order).filter(Order.id.in_(ids))}
+
+def test_available_agents_skip_stale_positions_and_count_load(Session):
+    with Session() as db:
+        agents = {agent_id: load for agent_id, _, _, load in dispatch._available_agents(db)}
+    assert agents == {10: 1, 11: 0}
+
+def test_dispatch_respects_capacity_and_skips_orders_without_coordinates(Session, monkeypatch):
+    monkeypatch.setattr(dispatch, "DISPATCH_BATCH_SIZE", 4)
+    ids = _add_orders(Session, [
+        # The oldest orders have no usable point; they must not fill the batch
+        ((None, None), (None, None)),
+        ((38.70, None), (None, -9.14)),
+        # Half a pickup point falls back to the delivery point
+        ((38.70, None), (38.70, -9.14)),
+        ((None, None), (38.70, -9.14)),
+        ((38.80, -9.14), (None, None)),
+        ((38.80, -9.14), (None, None)),
+    ])
+    with Session() as db:
+        assignments, summary = dispatch.dispatch_pending_orders(db)
+    assert summary == {"pending": 4, "agents": 2, "assigned": 3}
+    assert {a["order_id"]: a["assigned_agent_id"] for a in assignments} == {ids[2]: 10, ids[4]: 11, ids[5]: 11}
+    assert _statuses(Session, ids) == {
+        ids[0]: ("pending", None),
+        ids[1]: ("pending", None),
+        ids[2]: ("approved", 10),
+        # Agent 10 is full and agent 11 took its two nearest; stale agent 12 is never used
+        ids[3]: ("pending", None),
+        ids[4]: ("approved", 11),
+        ids[5]: ("approved", 11),
+    }
+
+def test_run_dispatch_publishes_the_same_events_as_approve_order(Session, monkeypatch):
+    from backend import main
+
+    published, targeted = [], []
+
+    async def publish_event(event):
+        published.append(event)
+
+    async def send_to_user(user_id, event):
+        targeted.append((user_id, event))
+
+    monkeypatch.setattr(main, "SessionLocal", Session)
+    monkeypatch.setattr(main, "publish_event", publish_event)
+    monkeypatch.setattr(main, "send_to_user", send_to_user)
+    dispatched, approved = _add_orders(Session, [((38.80, -9.14), (None, None))] * 2)
+
+    summary = asyncio.run(main.run_dispatch())
+    assert summary["assigned"] == 2
+    with Session() as db:
+        asyncio.run(main.approve_order(approved, main.OrderApproval(assigned_agent_id=10), db=db,
+                                       current_user={"role": "admin"}))
+    # The dispatcher took both orders for agent 11; the admin then reassigned one to agent 10
+    assert published == [
+        {"event": "order_status", "order_id": dispatched, "new_status": "approved", "owner_id": 1,
+         "assigned_agent_id": 11, "old_agent_id": None},
+        {"event": "order_status", "order_id": approved, "new_status": "approved", "owner_id": 1,
+         "assigned_agent_id": 11, "old_agent_id": None},
+        {"event": "order_status", "order_id": approved, "new_status": "approved", "owner_id": 1,
+         "assigned_agent_id": 10, "old_agent_id": 11},
+    ]
+    assert targeted == [
+        (11, {"event": "order_assigned", "order_id": dispatched, "status": "approved"}),
+        (11, {"event": "order_assigned", "order_id": approved, "status": "approved"}),
+        (10, {"event": "order_assigned", "order_id": approved, "status": "approved"}),
+    ]
@@ -0,0 +1,81 @@
+import math
+
+import pytest
+
+from backend.eta import EtaEstimator, ETA_DETOUR_FACTOR, ETA_DEFAULT_SPEED_MPS, ETA_WINDOW_SECONDS
+
+
+def _drive_north(estimator, agent_id, start_lat=9.0, speed_deg_per_s=0.0001, points=6):
+    # 0.0001 deg latitude per second is ~11.1 m/s
+    for i in range(points):
+        estimator.observe(agent_id, start_lat + i * 10 * speed_deg_per_s, 38.7, t=1000 + i * 10)
+
+def test_motion_estimates_speed_and_heading():
+    estimator = EtaEstimator()
+    _drive_north(estimator, 1)
+    lat, lon, speed, heading = estimator.motion(1)
+    assert abs(speed - 11.1) < 0.1
+    assert heading == 0
+
+def test_compute_eta_for_active_orders():
+    estimator = EtaEstimator()
+    _drive_north(estimator, 1)
+    # Target ~11.1 km north of the agent's last position
+    orders = [
+        (10, 1, 5, "in_transit", 9.005 + 0.1, 38.7, "delivery"),
+        (11, 2, 5, "approved", 9.1, 38.7, "pickup"),  # agent 2 has never pinged
+        (12, 1, 5, "approved", None, None, "delivery"),  # no coordinates
+    ]
+    records = estimator.compute(orders, now=1060)
+    assert list(records) == [10]
+    assert abs(records[10]["eta_seconds"] - 1000 * ETA_DETOUR_FACTOR) < 10
+
+def test_changed_only_reports_moves_past_threshold():
+    estimator = EtaEstimator()
+    first = {1: {"order_id": 1, "eta_seconds": 1000}}
+    assert estimator.changed(first) == [first[1]]
+    assert estimator.changed({1: {"order_id": 1, "eta_seconds": 1050}}) == []
+    moved = {1: {"order_id": 1, "eta_seconds": 800}}
+    assert estimator.changed(moved) == [moved[1]]
+    assert estimator.changed({}) == [] and estimator.etas == {}
+
+def test_motions_are_computed_per_agent_window():
+    estimator = EtaEstimator()
+    _drive_north(estimator, 1)
+    _drive_north(estimator, 2, start_lat=20.0, speed_deg_per_s=0.0002)
+    estimator.observe(3, 30.0, 38.7, t=1000)  # a single ping: position only
+    lat, lon, speed, heading = estimator.motions([1, 2, 3])
+    assert lat.tolist() == [9.005, 20.01, 30.0]
+    # The jump between agents' windows doesn't count as travel
+    assert abs(speed[0] - 11.1) < 0.1 and abs(speed[1] - 22.2) < 0.1
+    assert math.isnan(speed[2]) and math.isnan(heading[2])
+
+def test_compute_shares_motion_between_orders_of_one_agent():
+    estimator = EtaEstimator()
+    _drive_north(estimator, 1)
+    estimator.observe(2, 30.0, 38.7, t=1000)
+    records = estimator.compute([
+        (10, 1, 5, "in_transit", 9.105, 38.7, "delivery"),
+        (11, 2, 5, "approved", 30.1, 38.7, "pickup"),
+        (12, 1, 5, "approved", 9.205, 38.7, "pickup"),
+    ], now=1060)
+    assert records[12]["eta_seconds"] == pytest.approx(2 * records[10]["eta_seconds"], rel=0.01)
+    assert records[10]["heading"] == 0 and records[11]["heading"] is None
+    # Agent 2 has no speed yet, so the default applies
+    assert records[11]["speed_mps"] == ETA_DEFAULT_SPEED_MPS
+
+def test_silent_agents_stop_getting_etas():
+    estimator = EtaEstimator()
+    _drive_north(estimator, 1)  # last point at t=1050
+    estimator.observe(2, 30.0, 38.7, t=1000 + ETA_WINDOW_SECONDS)
+    orders = [(10, 1, 5, "in_transit", 9.105, 38.7, "delivery"), (11, 2, 5, "approved", 30.1, 38.7, "pickup")]
+    assert set(estimator.compute(orders, now=1050 + ETA_WINDOW_SECONDS - 1)) == {10, 11}
+    estimator.changed(estimator.compute(orders, now=1050 + ETA_WINDOW_SECONDS - 1))
+    estimator.dirty = False
+    # Agent 1's window is now entirely older than ETA_WINDOW_SECONDS
+    assert estimator.expire(now=1051 + ETA_WINDOW_SECONDS) == 1
+    assert estimator.dirty and list(estimator.windows) == [2]
+    records = estimator.compute(orders, now=1051 + ETA_WINDOW_SECONDS)
+    assert list(records) == [11]
+    estimator.changed(records)
+    assert list(estimator.etas) == [11]
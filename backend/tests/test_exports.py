@@ -0,0 +1,143 @@
+import csv
+import datetime
+import gzip
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from jose import jwt
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import main, exports
+from backend.main import ORDER_EXPORT_COLUMNS, LOCATION_EXPORT_COLUMNS
+from backend.models import Base, User, Order, DriverLocation
+
+DAY1 = datetime.datetime(2026, 1, 1, 12)
+DAY2 = datetime.datetime(2026, 1, 2, 12)
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'export.db'}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+    monkeypatch.setattr(exports, "read_session", lambda use_primary=False: Session())
+    monkeypatch.setattr(main, "SECRET_KEY", "test-secret")
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def seeded(engine):
+    """Owners 1 and 2; orders 1-2 belong to owner 1 (agent 10), order 3 to owner 2 (agent 11)"""
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [
+            {"id": i, "name": f"user {i}", "email": f"user{i}@example.com", "hashed_password": "x", "role": role}
+            for i, role in ((1, "owner"), (2, "owner"), (10, "agent"), (11, "agent"))
+        ])
+        conn.execute(Order.__table__.insert(), [
+            {"id": 1, "customer_name": "Ann, \"A\"", "delivery_address": "1 Main St", "status": "pending",
+             "owner_id": 1, "assigned_agent_id": 10, "created_at": DAY1, "updated_at": DAY1},
+            {"id": 2, "customer_name": "Bob", "delivery_address": "2 Main St", "status": "delivered",
+             "owner_id": 1, "assigned_agent_id": 10, "created_at": DAY2, "updated_at": DAY2},
+            {"id": 3, "customer_name": "Cy", "delivery_address": "3 Main St", "status": "approved",
+             "owner_id": 2, "assigned_agent_id": 11, "created_at": DAY2, "updated_at": DAY2},
+        ])
+        conn.execute(DriverLocation.__table__.insert(), [
+            {"id": 1, "agent_id": 10, "latitude": 9.0, "longitude": 38.7, "timestamp": DAY1},
+            {"id": 2, "agent_id": 11, "latitude": 9.1, "longitude": 38.8, "timestamp": DAY1},
+            {"id": 3, "agent_id": 10, "latitude": 9.2, "longitude": 38.9, "timestamp": DAY2},
+        ])
+
+
+def _get(path, role="admin", user_id=None, **params):
+    token = jwt.encode({"sub": f"{role}@example.com", "role": role, "user_id": user_id}, "test-secret", algorithm=main.ALGORITHM)
+    return TestClient(main.app).get(path, params=params, headers={"Authorization": f"Bearer {token}"})
+
+def _csv(response):
+    return list(csv.reader(io.StringIO(response.text)))
+
+def _ids(response):
+    return [int(row[0]) for row in _csv(response)[1:]]
+
+
+def test_empty_csv_export_still_has_the_header(engine):
+    response = _get("/export/orders")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["content-disposition"] == 'attachment; filename="orders.csv"'
+    assert _csv(response) == [ORDER_EXPORT_COLUMNS]
+    assert _csv(_get("/export/locations")) == [LOCATION_EXPORT_COLUMNS]
+
+def test_csv_rows_are_quoted_and_dated(seeded):
+    rows = _csv(_get("/export/orders"))
+    first = dict(zip(rows[0], rows[1]))
+    assert first["customer_name"] == 'Ann, "A"'
+    assert first["created_at"] == DAY1.isoformat()
+    assert len(rows) == 4
+
+def test_ndjson_export(seeded):
+    response = _get("/export/locations", fmt="ndjson")
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert [r["id"] for r in records] == [1, 2, 3]
+    assert records[0] == {"id": 1, "agent_id": 10, "latitude": 9.0, "longitude": 38.7, "timestamp": DAY1.isoformat()}
+
+def test_filters(seeded):
+    assert _ids(_get("/export/orders", start=DAY2.isoformat())) == [2, 3]
+    assert _ids(_get("/export/orders", end=DAY2.isoformat())) == [1]
+    assert _ids(_get("/export/orders", owner_id=2)) == [3]
+    assert _ids(_get("/export/orders", agent_id=10)) == [1, 2]
+    assert _ids(_get("/export/locations", agent_id=10, start=DAY2.isoformat())) == [3]
+    assert _ids(_get("/export/locations", owner_id=2)) == [2]
+
+def test_owner_is_pinned_to_own_rows(seeded):
+    # The owner_id parameter can't widen an owner's export
+    assert _ids(_get("/export/orders", role="owner", user_id=1, owner_id=2)) == [1, 2]
+    assert _ids(_get("/export/locations", role="owner", user_id=1, owner_id=2)) == [1, 3]
+
+def test_agents_cannot_export(seeded):
+    assert _get("/export/orders", role="agent", user_id=10).status_code == 403
+
+def test_invalid_format_is_rejected(seeded):
+    response = _get("/export/orders", fmt="xml")
+    assert response.status_code == 400
+    assert "csv" in response.json()["detail"]
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson"])
+def test_gzip_export_decompresses_to_the_plain_export(seeded, monkeypatch, fmt):
+    # Tiny chunks, so the gzip stream is built from many compressor calls
+    monkeypatch.setattr(exports, "EXPORT_CHUNK_BYTES", 16)
+    plain = _get("/export/orders", fmt=fmt)
+    compressed = _get("/export/orders", fmt=fmt, gzip="true")
+    assert compressed.headers["content-type"] == "application/gzip"
+    assert compressed.headers["content-disposition"] == f'attachment; filename="orders.{fmt}.gz"'
+    assert gzip.decompress(compressed.content) == plain.content
+
+def test_timezone_aware_filters(seeded):
+    # 2026-01-02T12:00 UTC written with an offset and with Z
+    assert _ids(_get("/export/orders", start="2026-01-02T14:00:00+02:00")) == [2, 3]
+    assert _ids(_get("/export/locations", end="2026-01-02T00:00:00Z")) == [1, 2]
+
+def test_track_accepts_timezone_aware_window(seeded, engine):
+    Session = sessionmaker(bind=engine)
+
+    def session():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    main.app.dependency_overrides[main.get_read_db] = session
+    try:
+        response = _get("/agents/10/track", start="2026-01-01T00:00:00Z", end="2026-01-02T13:00:00+01:00", tolerance=0)
+    finally:
+        main.app.dependency_overrides.clear()
+    assert response.status_code == 200
+    track = response.json()
+    assert track["start"] == "2026-01-01T00:00:00" and track["end"] == "2026-01-02T12:00:00"
+    # The point at exactly 12:00 UTC is excluded by the half-open window
+    assert [p["timestamp"] for p in track["path"]] == [DAY1.isoformat()]
@@ -0,0 +1,28 @@
+from backend.geo import simplify_track, encode_polyline, decode_polyline, haversine_m
+
+
+def test_encode_polyline_reference_example():
+    points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    assert encode_polyline(points) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+def test_polyline_roundtrip():
+    points = [(9.03, 38.74), (9.0312, 38.7421), (8.9999, 38.7001)]
+    decoded = decode_polyline(encode_polyline(points))
+    for (lat, lon), (dlat, dlon) in zip(points, decoded):
+        assert abs(lat - dlat) < 1e-5 and abs(lon - dlon) < 1e-5
+
+def test_simplify_drops_collinear_points():
+    # Straight line east with small GPS jitter, then a sharp turn north
+    line = [(9.0 + (0.00001 if i % 2 else 0), 38.7 + i * 0.001) for i in range(50)]
+    turn = [(9.0 + i * 0.001, 38.749) for i in range(1, 50)]
+    simplified = simplify_track(line + turn, tolerance_m=10)
+    assert simplified[0] == line[0]
+    assert simplified[-1] == turn[-1]
+    assert len(simplified) <= 4
+
+def test_simplify_zero_tolerance_keeps_everything():
+    points = [(9.0, 38.7), (9.1, 38.8), (9.0, 38.9)]
+    assert simplify_track(points, 0) == points
+
+def test_haversine_one_degree_latitude():
+    assert abs(haversine_m(0, 0, 1, 0) - 111195) < 50
@@ -0,0 +1,138 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from jose import jwt
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.websockets import WebSocketDisconnect
+
+from backend import main
+from backend.models import Base, User, DriverLocation
+from backend.presence import LocalRegistry
+
+AGENT_ID = 10
+
+
+@pytest.fixture
+def stream(tmp_path, monkeypatch):
+    """(connect(role, user_id), stored()) against a fresh database with agent 10 and 11"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'stream.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [
+            {"id": 1, "name": "admin", "email": "admin@example.com", "hashed_password": "x", "role": "admin"},
+            {"id": 2, "name": "owner", "email": "owner@example.com", "hashed_password": "x", "role": "owner"},
+            {"id": 10, "name": "agent", "email": "agent10@example.com", "hashed_password": "x", "role": "agent"},
+            {"id": 11, "name": "agent", "email": "agent11@example.com", "hashed_password": "x", "role": "agent"},
+        ])
+    Session = sessionmaker(bind=engine, autoflush=False)
+    monkeypatch.setattr(main, "SessionLocal", Session)
+    monkeypatch.setattr(main, "SECRET_KEY", "test-secret")
+    monkeypatch.setattr(main, "LOCATION_ADMISSION", "off")
+    monkeypatch.setattr(main, "redis_available", False)
+    monkeypatch.setattr(main, "registry", LocalRegistry())
+    monkeypatch.setattr(main, "WS_LOCATION_BATCH_SIZE", 2)
+    monkeypatch.setattr(main, "WS_LOCATION_FLUSH_SECONDS", 60)
+    client = TestClient(main.app)
+
+    def connect(role="agent", user_id=AGENT_ID):
+        token = jwt.encode({"sub": f"{role}@example.com", "role": role, "user_id": user_id}, "test-secret", algorithm=main.ALGORITHM)
+        return client.websocket_connect(f"/ws/locations?token={token}")
+
+    def stored():
+        session = Session()
+        try:
+            return [(d.agent_id, d.latitude, d.longitude) for d in session.query(DriverLocation).order_by(DriverLocation.id)]
+        finally:
+            session.close()
+
+    yield connect, stored
+    engine.dispose()
+
+
+def test_bad_token_and_role_are_rejected(stream):
+    connect, _ = stream
+    with pytest.raises(WebSocketDisconnect) as error:
+        with TestClient(main.app).websocket_connect("/ws/locations?token=nonsense"):
+            pass
+    assert error.value.code == 1008
+    with pytest.raises(WebSocketDisconnect) as error:
+        with connect("owner", 2):
+            pass
+    assert error.value.code == 1008
+
+def test_full_batch_is_flushed_and_acked(stream):
+    connect, stored = stream
+    with connect() as ws:
+        ws.send_json({"seq": 1, "latitude": 9.0, "longitude": 38.7})
+        ws.send_json([{"seq": 2, "latitude": 9.1, "longitude": 38.7}, {"seq": 3, "latitude": 9.2, "longitude": 38.7}])
+        assert ws.receive_json() == {"event": "ack", "seq": 3, "count": 3, "merged": 0, "dropped": 0}
+    assert stored() == [(AGENT_ID, 9.0, 38.7), (AGENT_ID, 9.1, 38.7), (AGENT_ID, 9.2, 38.7)]
+
+def test_partial_batch_is_flushed_on_the_timer(stream, monkeypatch):
+    connect, stored = stream
+    monkeypatch.setattr(main, "WS_LOCATION_FLUSH_SECONDS", 0.1)
+    with connect() as ws:
+        ws.send_json({"seq": 7, "latitude": 9.0, "longitude": 38.7})
+        started = time.monotonic()
+        assert ws.receive_json() == {"event": "ack", "seq": 7, "count": 1, "merged": 0, "dropped": 0}
+        assert time.monotonic() - started < 5
+    assert stored() == [(AGENT_ID, 9.0, 38.7)]
+
+def test_pending_points_are_stored_on_disconnect(stream):
+    connect, stored = stream
+    with connect() as ws:
+        ws.send_json({"seq": 1, "latitude": 9.0, "longitude": 38.7})
+        ws.close()
+        # Leaving the block cancels the app, so wait for the write inside it
+        deadline = time.monotonic() + 5
+        while not stored() and time.monotonic() < deadline:
+            time.sleep(0.01)
+    assert stored() == [(AGENT_ID, 9.0, 38.7)]
+
+def test_admin_frames_for_unknown_agents_are_rejected(stream):
+    connect, stored = stream
+    with connect("admin", 1) as ws:
+        ws.send_json([{"agent_id": 11, "latitude": 9.0, "longitude": 38.7}, {"agent_id": 999, "latitude": 9.1, "longitude": 38.7}])
+        assert ws.receive_json() == {"event": "error", "detail": "Unknown agent_id: 999"}
+        # Owners aren't agents either
+        ws.send_json({"agent_id": 2, "latitude": 9.1, "longitude": 38.7})
+        assert ws.receive_json()["event"] == "error"
+        ws.send_json([{"seq": 1, "agent_id": 11, "latitude": 9.0, "longitude": 38.7}, {"seq": 2, "agent_id": 10, "latitude": 9.1, "longitude": 38.7}])
+        assert ws.receive_json()["count"] == 2
+    assert stored() == [(11, 9.0, 38.7), (10, 9.1, 38.7)]
+
+def test_failed_batch_is_reported_and_the_stream_continues(stream, monkeypatch):
+    connect, stored = stream
+    persist = main._persist_location_batch
+
+    def fail_once(points):
+        monkeypatch.setattr(main, "_persist_location_batch", persist)
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(main, "_persist_location_batch", fail_once)
+    with connect() as ws:
+        ws.send_json([{"seq": 1, "latitude": 9.0, "longitude": 38.7}, {"seq": 2, "latitude": 9.1, "longitude": 38.7}])
+        assert ws.receive_json() == {"event": "error", "detail": "Could not store locations", "seq": 2, "count": 2}
+        ws.send_json([{"seq": 3, "latitude": 9.2, "longitude": 38.7}, {"seq": 4, "latitude": 9.3, "longitude": 38.7}])
+        assert ws.receive_json()["event"] == "ack"
+    assert stored() == [(AGENT_ID, 9.2, 38.7), (AGENT_ID, 9.3, 38.7)]
+
+def test_points_keep_their_receive_time_and_order(stream, monkeypatch):
+    connect, _ = stream
+    monkeypatch.setattr(main, "WS_LOCATION_BATCH_SIZE", 3)
+    with connect() as ws:
+        ws.send_json({"seq": 1, "latitude": 9.0, "longitude": 38.7})
+        time.sleep(0.05)
+        ws.send_json([{"seq": 2, "latitude": 9.1, "longitude": 38.7}, {"seq": 3, "latitude": 9.2, "longitude": 38.7}])
+        assert ws.receive_json()["count"] == 3
+    db = main.SessionLocal()
+    try:
+        rows = db.query(DriverLocation).order_by(DriverLocation.id).all()
+        track = main._build_track(db, AGENT_ID, None, None, 0, "json")
+    finally:
+        db.close()
+    # The first point was stored at its own arrival, not at the flush
+    assert rows[0].timestamp < rows[1].timestamp == rows[2].timestamp
+    assert [p["latitude"] for p in track["path"]] == [9.0, 9.1, 9.2]
@@ -0,0 +1,117 @@
+import datetime
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import main, mapview
+from backend.mapview import CLUSTER_MAX_ZOOM
+from backend.migrations import migrate, _create_agent_positions
+from backend.models import User, Order, Vehicle, AgentPosition
+
+ADMIN = {"role": "admin", "user_id": None}
+OWNER = {"role": "owner", "user_id": 1}
+BBOX = {"south": 38.6, "west": 9.0, "north": 38.8, "east": 9.2}
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Owners 1-2, agents 10-13 (13 outside BBOX); agent 10 has moved once"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'map.db'}")
+    migrate(engine)
+    session = sessionmaker(bind=engine, autoflush=False)()
+    session.add_all(
+        [User(id=i, name=f"owner {i}", email=f"owner{i}@example.com", role="owner") for i in (1, 2)]
+        + [User(id=i, name=f"agent {i}", email=f"agent{i}@example.com", role="agent") for i in (10, 11, 12, 13)]
+        + [
+            Order(customer_name="a", delivery_address="a", delivery_latitude=38.705, delivery_longitude=9.105,
+                  owner_id=1, assigned_agent_id=10),
+            Order(customer_name="b", delivery_address="b", delivery_latitude=38.725, delivery_longitude=9.125,
+                  owner_id=2, assigned_agent_id=11),
+            Vehicle(license_plate="P1", owner_id=1, current_latitude=38.7, current_longitude=9.1,
+                    approval_status="approved"),
+        ]
+    )
+    session.commit()
+    first, later = datetime.datetime(2026, 1, 1, 12), datetime.datetime(2026, 1, 1, 12, 1)
+    main.persist_locations(session, [(10, 38.70, 9.10, first), (11, 38.72, 9.12, first), (12, 38.73, 9.13, first), (13, 40.0, 10.0, first)])
+    main.persist_locations(session, [(10, 38.71, 9.11, later)])
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _map(db, zoom, user=ADMIN, layers="agents", **bbox):
+    return main.get_map(**dict(BBOX, **bbox), zoom=zoom, layers=layers, db=db, current_user=user)["layers"]
+
+
+@pytest.mark.parametrize("params", [
+    {"south": 38.8, "north": 38.6},
+    {"south": -91},
+    {"west": 9.2, "east": 9.0},
+    {"east": 181},
+    {"zoom": 23},
+    {"layers": "agents,trucks"},
+])
+def test_invalid_viewport_is_rejected(db, params):
+    args = dict(BBOX, zoom=CLUSTER_MAX_ZOOM, layers="agents")
+    args.update(params)
+    with pytest.raises(HTTPException) as error:
+        main.get_map(**args, db=db, current_user=ADMIN)
+    assert error.value.status_code == 400
+
+def test_points_at_high_zoom_use_latest_positions(db):
+    points = _map(db, CLUSTER_MAX_ZOOM)["agents"]["points"]
+    assert {p["id"]: (p["latitude"], p["longitude"]) for p in points} == {
+        10: (38.71, 9.11), 11: (38.72, 9.12), 12: (38.73, 9.13),
+    }
+
+def test_clusters_below_cluster_zoom(db):
+    layer = _map(db, CLUSTER_MAX_ZOOM - 1)["agents"]
+    assert "points" not in layer
+    assert sum(cluster["count"] for cluster in layer["clusters"]) == 3
+    # At zoom 2 one cell covers the whole viewport
+    clusters = _map(db, 2)["agents"]["clusters"]
+    assert len(clusters) == 1 and clusters[0]["count"] == 3
+
+def test_point_limit_falls_back_to_clusters(db, monkeypatch):
+    monkeypatch.setattr(mapview, "MAP_POINT_LIMIT", 2)
+    layer = _map(db, CLUSTER_MAX_ZOOM)["agents"]
+    assert "points" not in layer and sum(c["count"] for c in layer["clusters"]) == 3
+
+def test_owner_sees_own_markers_only(db):
+    layers = _map(db, CLUSTER_MAX_ZOOM, user=OWNER, layers="agents,vehicles,orders")
+    assert [p["id"] for p in layers["agents"]["points"]] == [10]
+    assert [p["latitude"] for p in layers["orders"]["points"]] == [38.705]
+    assert len(layers["vehicles"]["points"]) == 1
+    assert len(_map(db, CLUSTER_MAX_ZOOM, layers="orders")["orders"]["points"]) == 2
+
+def test_only_open_orders_and_approved_vehicles_are_shown(db):
+    db.add_all([
+        Order(customer_name="c", delivery_address="c", delivery_latitude=38.71, delivery_longitude=9.11,
+              owner_id=1, status="delivered"),
+        Order(customer_name="d", delivery_address="d", delivery_latitude=38.72, delivery_longitude=9.12,
+              owner_id=1, status="in_transit"),
+        Vehicle(license_plate="P2", owner_id=1, current_latitude=38.71, current_longitude=9.11),
+        Vehicle(license_plate="P3", owner_id=1, current_latitude=38.72, current_longitude=9.12,
+                approval_status="rejected"),
+    ])
+    db.commit()
+    layers = _map(db, CLUSTER_MAX_ZOOM, layers="vehicles,orders")
+    assert sorted(p["latitude"] for p in layers["orders"]["points"]) == [38.705, 38.72, 38.725]
+    assert [p["latitude"] for p in layers["vehicles"]["points"]] == [38.7]
+    assert sum(c["count"] for c in _map(db, 2, layers="orders")["orders"]["clusters"]) == 3
+
+def test_migration_seeds_positions_from_history(db):
+    db.query(AgentPosition).delete()
+    db.commit()
+    _create_agent_positions(db.connection())
+    db.commit()
+    positions = {p.agent_id: (p.latitude, p.longitude) for p in db.query(AgentPosition)}
+    assert positions[10] == (38.71, 9.11) and len(positions) == 4
+
+def test_late_batch_does_not_move_an_agent_back(db):
+    main.persist_locations(db, [(11, 38.0, 9.0, datetime.datetime(2026, 1, 1, 11)), (12, 38.74, 9.14, datetime.datetime(2026, 1, 1, 13))])
+    positions = {p.agent_id: (p.latitude, p.longitude) for p in db.query(AgentPosition)}
+    assert positions[11] == (38.72, 9.12) and positions[12] == (38.74, 9.14)
@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from jose import jwt
+
+from backend import main, presence
+from backend.presence import LocalRegistry, WORKER_ID, PRESENCE_TTL_SECONDS, user_channel
+
+
+def test_register_and_unregister():
+    async def run():
+        registry = LocalRegistry()
+        await registry.register("a", 5, "agent")
+        await registry.register("b", None, None)
+        first = await registry.connections()
+        await registry.unregister("a")
+        await registry.unregister("missing")
+        return first, await registry.connections()
+
+    first, after = asyncio.run(run())
+    assert list(first) == [WORKER_ID]
+    assert [(c["user_id"], c["role"]) for c in first[WORKER_ID]] == [(5, "agent"), (None, None)]
+    assert [(c["user_id"], c["role"]) for c in after[WORKER_ID]] == [(None, None)]
+
+def test_online_agents_ttl_cutoff(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(presence.time, "time", lambda: now[0])
+
+    async def run():
+        registry = LocalRegistry()
+        await registry.mark_agent_seen(1)
+        now[0] += PRESENCE_TTL_SECONDS / 2
+        await registry.mark_agent_seen(2)
+        now[0] += PRESENCE_TTL_SECONDS / 2
+        # Agent 1 is exactly at the cutoff, agent 2 well inside it
+        at_cutoff = await registry.online_agents()
+        now[0] += 1
+        return at_cutoff, await registry.online_agents()
+
+    at_cutoff, later = asyncio.run(run())
+    assert set(at_cutoff) == {1, 2}
+    assert later == {2: 1000.0 + PRESENCE_TTL_SECONDS / 2}
+
+
+def _token(user_id):
+    return jwt.encode({"sub": f"user{user_id}@example.com", "role": "agent", "user_id": user_id},
+                      main.SECRET_KEY, algorithm=main.ALGORITHM)
+
+def test_send_to_user_reaches_only_that_users_sockets(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(main, "redis_pool", fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(main, "redis_available", True)
+    monkeypatch.setattr(main, "registry", LocalRegistry())
+    monkeypatch.setattr(main, "SECRET_KEY", "test-secret")
+    # The app runs in the client's own event loop; the test talks to the same server from this one
+    publisher = fakeredis.FakeRedis(server=server, decode_responses=True)
+
+    def wait_subscribed(channel):
+        deadline = time.monotonic() + 5
+        while not dict(publisher.pubsub_numsub(channel)).get(channel):
+            assert time.monotonic() < deadline, f"nobody subscribed to {channel}"
+            time.sleep(0.01)
+
+    client = TestClient(main.app)
+    with client.websocket_connect(f"/ws/orders?token={_token(5)}") as five, \
+            client.websocket_connect(f"/ws/orders?token={_token(6)}") as six:
+        wait_subscribed(user_channel(5))
+        wait_subscribed(user_channel(6))
+        monkeypatch.setattr(main, "redis_pool", fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+        asyncio.run(main.send_to_user(5, {"event": "order_assigned", "order_id": 1}))
+        publisher.publish("ops_events", '{"event": "order_created", "order_id": 2}')
+        assert five.receive_json() == {"event": "order_assigned", "order_id": 1}
+        assert five.receive_json()["event"] == "order_created"
+        # User 6 sees the broadcast but never the event meant for user 5
+        assert six.receive_json() == {"event": "order_created", "order_id": 2}
+    assert main.manager.active_connections == [] and main.manager.connection_ids == {}
+
+def test_failed_subscribe_leaves_no_connection(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    server.connected = False
+    monkeypatch.setattr(main, "redis_pool", fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(main, "redis_available", True)
+    monkeypatch.setattr(main, "registry", LocalRegistry())
+
+    client = TestClient(main.app)
+    with pytest.raises(Exception):
+        with client.websocket_connect("/ws/orders") as ws:
+            ws.receive_text()
+    assert main.manager.active_connections == [] and main.manager.connection_ids == {}
+    assert asyncio.run(main.registry.connections()) == {WORKER_ID: []}
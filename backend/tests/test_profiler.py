@@ -0,0 +1,91 @@
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.profiler import SamplingProfiler, ProfilerMiddleware
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def _make_app(profiler):
+    app = FastAPI()
+    app.add_middleware(ProfilerMiddleware, profiler=profiler)
+
+    @app.get("/async")
+    async def async_route():
+        _busy(0.05)
+        return {}
+
+    @app.get("/sync")
+    def sync_route():
+        _busy(0.05)
+        return {}
+
+    @app.get("/offload")
+    async def offload_route():
+        await profiler.run_in_threadpool(_busy, 0.05)
+        return {}
+
+    @app.get("/other")
+    def other_route():
+        _busy(0.05)
+        return {}
+
+    return app
+
+
+def test_samples_async_and_threadpool_handlers():
+    profiler = SamplingProfiler()
+    client = TestClient(_make_app(profiler))
+    profiler.start(fraction=1.0, interval_ms=2)
+    try:
+        for _ in range(3):
+            client.get("/async")
+            client.get("/sync")
+    finally:
+        profiler.stop()
+    roots = {line.split(";")[0] for line in profiler.collapsed().splitlines()}
+    assert roots == {"GET /async", "GET /sync"}
+    assert any("_busy" in line for line in profiler.collapsed().splitlines())
+    # Every line ends with its sample count
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in profiler.collapsed().splitlines()) == profiler.samples
+
+def test_route_filter_only_samples_that_route():
+    profiler = SamplingProfiler()
+    client = TestClient(_make_app(profiler))
+    profiler.start(route="/sync", interval_ms=2)
+    try:
+        client.get("/sync")
+        client.get("/other")
+    finally:
+        profiler.stop()
+    assert profiler.requests_sampled == 1
+    assert {line.split(";")[0] for line in profiler.collapsed().splitlines()} == {"GET /sync"}
+
+def test_disabled_profiler_runs_no_thread_and_records_nothing():
+    profiler = SamplingProfiler()
+    client = TestClient(_make_app(profiler))
+    client.get("/sync")
+    assert profiler._thread is None
+    assert profiler.requests_sampled == 0
+    assert profiler.collapsed() == ""
+
+def test_threadpool_work_of_async_handlers_is_sampled():
+    profiler = SamplingProfiler()
+    client = TestClient(_make_app(profiler))
+    profiler.start(route="/offload", interval_ms=2)
+    try:
+        for _ in range(3):
+            client.get("/offload")
+    finally:
+        profiler.stop()
+    lines = profiler.collapsed().splitlines()
+    assert lines and all(line.startswith("GET /offload;") for line in lines)
+    assert any("_busy" in line for line in lines)
+    # Worker threads are released when the work returns
+    assert profiler._threads == {}
@@ -0,0 +1,265 @@
+"""
+Query-plan regression tests for the hot endpoints.
+
+Each handler runs against a seeded database while every statement it issues
+is captured; the statements are then EXPLAINed and the test fails if any of
+them reads a table with a full scan where an index should be used. SQLite
+always runs; Postgres runs when QUERY_PLAN_POSTGRES_URL points at a scratch
+database (its tables are dropped and recreated).
+"""
+import asyncio
+import datetime
+import inspect
+import json
+import os
+import random
+import re
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+from starlette.requests import Request
+
+from backend import main
+from backend.cache import MemoryReadCache
+from backend.db import _engine_args
+from backend.migrations import migrate
+from backend.models import Base, User, Order, Vehicle, DriverLocation, AgentPosition
+
+OWNERS = 50
+AGENTS = 200
+ORDERS = 20000
+VEHICLES = 2000
+LOCATIONS_PER_AGENT = 100
+
+OWNER_ID = 1  # owners get ids 1..OWNERS
+AGENT_ID = OWNERS + 1  # first agent; has an assigned vehicle
+
+POSTGRES_URL = os.getenv("QUERY_PLAN_POSTGRES_URL")
+
+# Only SEARCH seeks into an index. "SCAN t" reads the whole table and
+# "SCAN t USING [COVERING] INDEX i" the whole index, which costs the same
+SQLITE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+
+
+def _sqlite_full_scan(detail):
+    """Table name if an EXPLAIN QUERY PLAN line reads a whole table or index, else None"""
+    match = SQLITE_SCAN.match(detail)
+    return match.group(1) if match else None
+
+
+def _postgres_full_scan(node):
+    """Table name if a plan node reads a whole table, or a whole index without a condition"""
+    if node["Node Type"] == "Seq Scan":
+        return node.get("Relation Name")
+    if node["Node Type"] in ("Index Scan", "Index Only Scan") and "Index Cond" not in node:
+        return node.get("Relation Name")
+    return None
+
+
+def _seed(engine):
+    rnd = random.Random(42)
+    now = datetime.datetime.utcnow()
+    users = [
+        {"id": i, "name": f"owner {i}", "email": f"owner{i}@example.com", "hashed_password": "x", "role": "owner"}
+        for i in range(1, OWNERS + 1)
+    ] + [
+        {"id": i, "name": f"agent {i}", "email": f"agent{i}@example.com", "hashed_password": "x", "role": "agent"}
+        for i in range(OWNERS + 1, OWNERS + AGENTS + 1)
+    ]
+    agent_ids = [u["id"] for u in users if u["role"] == "agent"]
+    orders = [
+        {
+            "customer_name": f"customer {i}",
+            "delivery_address": f"{i} Main St",
+            "delivery_latitude": 38.0 + rnd.random(),
+            "delivery_longitude": 9.0 + rnd.random(),
+            "status": rnd.choice(["pending", "approved", "picked_up", "in_transit", "delivered"]),
+            "assigned_agent_id": rnd.choice(agent_ids),
+            "owner_id": rnd.randint(1, OWNERS),
+            "created_at": now,
+            "updated_at": now,
+        }
+        for i in range(ORDERS)
+    ]
+    vehicles = [
+        {
+            "license_plate": f"PLATE-{i}",
+            "model": "van",
+            "vehicle_type": "van",
+            "owner_id": rnd.randint(1, OWNERS),
+            "assigned_agent_id": agent_ids[i] if i < len(agent_ids) else None,
+            "current_latitude": 38.0 + rnd.random(),
+            "current_longitude": 9.0 + rnd.random(),
+            "created_at": now,
+            "updated_at": now,
+        }
+        for i in range(VEHICLES)
+    ]
+    locations = [
+        {
+            "agent_id": agent_id,
+            "latitude": 38.0 + rnd.random(),
+            "longitude": 9.0 + rnd.random(),
+            "timestamp": now - datetime.timedelta(seconds=30 * n),
+        }
+        for agent_id in agent_ids
+        for n in range(LOCATIONS_PER_AGENT)
+    ]
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), users)
+        conn.execute(Order.__table__.insert(), orders)
+        conn.execute(Vehicle.__table__.insert(), vehicles)
+        conn.execute(DriverLocation.__table__.insert(), locations)
+        conn.execute(AgentPosition.__table__.insert(), [
+            {"agent_id": agent_id, "latitude": 38.0 + rnd.random(), "longitude": 9.0 + rnd.random(), "timestamp": now}
+            for agent_id in agent_ids
+        ])
+        # Give the planner real statistics, as a production database would have
+        conn.execute(text("ANALYZE"))
+
+
+def _make_engine(url):
+    url, connect_args = _engine_args(url)
+    return create_engine(url, connect_args=connect_args)
+
+
+@pytest.fixture(scope="module", params=["sqlite", "postgresql"])
+def engine(request, tmp_path_factory):
+    if request.param == "sqlite":
+        engine = _make_engine(f"sqlite:///{tmp_path_factory.mktemp('plans') / 'plans.db'}")
+    else:
+        if not POSTGRES_URL:
+            pytest.skip("QUERY_PLAN_POSTGRES_URL not set")
+        engine = _make_engine(POSTGRES_URL)
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS schema_migrations"))
+            Base.metadata.drop_all(bind=conn)
+    # Build the schema through the migrations, so they are what gets checked
+    migrate(engine)
+    _seed(engine)
+    yield engine
+    if request.param == "postgresql":
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS schema_migrations"))
+            Base.metadata.drop_all(bind=conn)
+    engine.dispose()
+
+
+@pytest.fixture
+def capture(engine, monkeypatch):
+    """Run a handler and return the (statement, parameters) it sent to the database"""
+    monkeypatch.setattr(main, "read_cache", MemoryReadCache())
+    monkeypatch.setattr(main, "LOCATION_ADMISSION", "off")
+    Session = sessionmaker(bind=engine, autoflush=False)
+
+    def run(handler, **kwargs):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if not executemany:
+                statements.append((statement, parameters))
+
+        if "request" in inspect.signature(handler).parameters:
+            kwargs["request"] = Request({"type": "http", "method": "GET", "path": "/", "headers": []})
+        event.listen(engine, "before_cursor_execute", record)
+        db = Session()
+        try:
+            result = handler(db=db, **kwargs)
+            if asyncio.iscoroutine(result):
+                asyncio.run(result)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+            db.rollback()
+            db.close()
+        return [(s, p) for s, p in statements if s.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE"))]
+
+    return run
+
+
+def full_scans(engine, statements):
+    """Tables read with a full scan by any of the statements"""
+    tables = set(Base.metadata.tables)
+    scans = []
+    with engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            # With sequential scans priced out, a Seq Scan in the plan means
+            # no usable index exists, whatever the table size or statistics
+            conn.execute(text("SET enable_seqscan = off"))
+        for statement, parameters in statements:
+            if conn.dialect.name == "postgresql":
+                plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                nodes = [plan[0]["Plan"]]
+                while nodes:
+                    node = nodes.pop()
+                    nodes.extend(node.get("Plans", []))
+                    table = _postgres_full_scan(node)
+                    if table in tables:
+                        scans.append((table, statement))
+            else:
+                for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters):
+                    table = _sqlite_full_scan(row[-1])
+                    if table in tables:
+                        scans.append((table, statement))
+    return scans
+
+
+OWNER = {"role": "owner", "user_id": OWNER_ID}
+ADMIN = {"role": "admin", "user_id": None}
+AGENT = {"role": "agent", "user_id": AGENT_ID}
+
+
+def test_read_orders_owner_uses_index(engine, capture):
+    statements = capture(main.read_orders, current_user=OWNER)
+    assert statements
+    assert full_scans(engine, statements) == []
+
+def test_read_orders_admin_scans_only_orders(engine, capture):
+    # The unfiltered list reads the whole table by design; nothing else may
+    statements = capture(main.read_orders, current_user=ADMIN)
+    assert {table for table, _ in full_scans(engine, statements)} <= {"orders"}
+
+def test_get_locations_reads_only_latest_positions(engine, capture):
+    # One row per agent is the whole answer; the location history is never read
+    statements = capture(main.get_locations, current_user=ADMIN)
+    assert statements
+    assert {table for table, _ in full_scans(engine, statements)} <= {"agent_positions"}
+
+@pytest.mark.parametrize("user", [ADMIN, OWNER], ids=["admin", "owner"])
+def test_get_agents_uses_index(engine, capture, user):
+    statements = capture(main.get_agents, current_user=user)
+    assert statements
+    assert full_scans(engine, statements) == []
+
+def test_get_vehicles_owner_uses_index(engine, capture):
+    statements = capture(main.get_vehicles, current_user=OWNER)
+    assert statements
+    assert full_scans(engine, statements) == []
+
+def test_get_vehicles_all_scans_only_vehicles(engine, capture):
+    statements = capture(main.get_vehicles, current_user=AGENT)
+    assert {table for table, _ in full_scans(engine, statements)} <= {"vehicles"}
+
+def test_update_location_uses_index(engine, capture):
+    loc = main.DriverLocationCreate(agent_id=AGENT_ID, latitude=38.7, longitude=9.1)
+    statements = capture(main.update_location, loc=loc, current_user=AGENT)
+    # Vehicle lookup by agent, vehicle position update, and the refresh of the new row
+    assert any(s.lstrip().upper().startswith("UPDATE") for s, _ in statements)
+    assert full_scans(engine, statements) == []
+
+def test_sqlite_plan_lines_are_classified_by_table_name():
+    assert _sqlite_full_scan("SCAN orders") == "orders"
+    assert _sqlite_full_scan("SCAN TABLE orders") == "orders"
+    # Walking a whole index reads as much as the table
+    assert _sqlite_full_scan("SCAN orders USING INDEX ix_orders_status") == "orders"
+    assert _sqlite_full_scan("SCAN driver_locations USING COVERING INDEX ix_driver_locations_agent_id_timestamp") == "driver_locations"
+    assert _sqlite_full_scan("SEARCH orders USING INDEX ix_orders_owner_id (owner_id=?)") is None
+    assert _sqlite_full_scan("SEARCH driver_locations USING COVERING INDEX ix_driver_locations_agent_id_timestamp (agent_id=?)") is None
+
+def test_postgres_plan_nodes_are_classified():
+    assert _postgres_full_scan({"Node Type": "Seq Scan", "Relation Name": "orders"}) == "orders"
+    assert _postgres_full_scan({"Node Type": "Index Only Scan", "Relation Name": "driver_locations"}) == "driver_locations"
+    assert _postgres_full_scan({"Node Type": "Index Scan", "Relation Name": "orders", "Index Cond": "(owner_id = 1)"}) is None
+    assert _postgres_full_scan({"Node Type": "Bitmap Heap Scan", "Relation Name": "orders"}) is None
@@ -0,0 +1,123 @@
+"""
+Read-cache invalidation driven by the real handlers: each scenario warms the
+cached lists, fires the endpoint that writes, and checks the next read.
+"""
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import main
+from backend.cache import MemoryReadCache, RedisReadCache, MemoryCollectionVersions, event_tags
+from backend.models import Base, User
+
+ADMIN = {"role": "admin", "user_id": 1}
+OWNER = {"role": "owner", "user_id": 2}
+
+
+def _memory_cache():
+    return MemoryReadCache()
+
+def _redis_cache():
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisReadCache(fakeredis.FakeAsyncRedis())
+
+
+@pytest.fixture(params=[_memory_cache, _redis_cache], ids=["memory", "redis"])
+def app(request, tmp_path, monkeypatch):
+    """Seeded database with admin 1, owner 2 and agent 3; returns (Session, make_cache)"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'cache.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [
+            {"id": 1, "name": "admin", "email": "admin@example.com", "hashed_password": "x", "role": "admin"},
+            {"id": 2, "name": "owner", "email": "owner@example.com", "hashed_password": "x", "role": "owner"},
+            {"id": 3, "name": "agent", "email": "agent3@example.com", "hashed_password": "x", "role": "agent"},
+        ])
+    Session = sessionmaker(bind=engine, autoflush=False)
+    monkeypatch.setattr(main, "redis_available", False)
+    monkeypatch.setattr(main, "collection_versions", MemoryCollectionVersions())
+    monkeypatch.setattr(main, "send_to_user", lambda user_id, event: asyncio.sleep(0))
+    # The Redis client binds to the loop it is first used on, so each scenario builds its own
+    yield Session, request.param
+    engine.dispose()
+
+
+def _run(app, scenario):
+    Session, make_cache = app
+
+    async def call(handler, **kwargs):
+        db = Session()
+        try:
+            return await handler(db=db, **kwargs)
+        finally:
+            db.close()
+
+    async def agents(user=ADMIN):
+        response = await call(main.get_agents, current_user=user)
+        return sorted(agent["id"] for agent in json.loads(response.body))
+
+    async def run():
+        main.read_cache = make_cache()
+        await scenario(call, agents)
+
+    original = main.read_cache
+    try:
+        asyncio.run(run())
+    finally:
+        main.read_cache = original
+
+
+def _signup(email, role):
+    return main.UserCreate(name=email, email=email, password="secret1", role=role)
+
+
+def test_agent_signup_refreshes_agent_list(app):
+    async def scenario(call, agents):
+        assert await agents() == [3]
+        await call(main.signup, user=_signup("owner4@example.com", "owner_pending"))
+        # Not an agent: the cached list survives
+        assert await main.read_cache.get("agents:admin") is not None
+        await call(main.signup, user=_signup("agent5@example.com", "agent"))
+        assert await agents() == [3, 5]
+    _run(app, scenario)
+
+def test_role_update_and_delete_refresh_agent_list(app):
+    async def scenario(call, agents):
+        await call(main.signup, user=_signup("agent4@example.com", "agent_pending"))
+        assert await agents() == [3]
+        await call(main.update_user_role, user_id=4, role_update=main.UserRoleUpdate(role="agent"), current_user=ADMIN)
+        assert await agents() == [3, 4]
+        await call(main.update_user_role, user_id=3, role_update=main.UserRoleUpdate(role="rejected"), current_user=ADMIN)
+        assert await agents() == [4]
+    _run(app, scenario)
+
+def test_owner_agent_membership_follows_orders(app):
+    async def scenario(call, agents):
+        await call(main.signup, user=_signup("agent4@example.com", "agent"))
+        assert await agents(OWNER) == []
+        order = await call(main.create_order, order=main.OrderCreate(
+            customer_name="c", delivery_address="a", assigned_agent_id=3,
+        ), current_user=OWNER)
+        assert await agents(OWNER) == [3]
+        await call(main.approve_order, order_id=order.id, approval=main.OrderApproval(assigned_agent_id=4), current_user=ADMIN)
+        assert await agents(OWNER) == [4]
+        # Same agent again: the membership entry is left alone
+        await call(main.approve_order, order_id=order.id, approval=main.OrderApproval(assigned_agent_id=4), current_user=ADMIN)
+        assert await main.read_cache.get("owner_agents:2") is not None
+    _run(app, scenario)
+
+
+def test_event_tags():
+    assert event_tags({"event": "user_signup", "role": "agent"}) == ["users", "agents"]
+    assert event_tags({"event": "user_signup", "role": "agent_pending"}) == ["users"]
+    assert event_tags({"event": "order_created", "owner_id": 2, "assigned_agent_id": 3}) == ["owner_agents:2"]
+    assert event_tags({"event": "order_created", "owner_id": 2, "assigned_agent_id": None}) == []
+    assert event_tags({"event": "order_status", "owner_id": 2, "assigned_agent_id": 4, "old_agent_id": 3}) == [
+        "vehicles", "owner_agents:2",
+    ]
+    # Status changes without an agent change keep the membership entry
+    assert event_tags({"event": "order_status", "owner_id": 2, "assigned_agent_id": 3, "old_agent_id": 3}) == ["vehicles"]
+    assert event_tags({"event": "order_status", "owner_id": 2}) == ["vehicles"]
@@ -0,0 +1,28 @@
+import json
+
+import msgpack
+
+from backend.realtime import EventBatcher, encode_frame
+
+
+def test_batcher_keeps_only_newest_location_per_agent():
+    batcher = EventBatcher()
+    batcher.add({"event": "location_update", "agent_id": 1, "latitude": 1})
+    batcher.add({"event": "order_created", "order_id": 7})
+    batcher.add({"event": "location_update", "agent_id": 2, "latitude": 2})
+    batcher.add({"event": "location_update", "agent_id": 1, "latitude": 3})
+    assert len(batcher) == 3
+    assert batcher.drain() == [
+        {"event": "order_created", "order_id": 7},
+        {"event": "location_update", "agent_id": 2, "latitude": 2},
+        {"event": "location_update", "agent_id": 1, "latitude": 3},
+    ]
+    assert batcher.drain() == []
+
+def test_encode_frame_json_and_msgpack():
+    payload = {"event": "batch", "events": [{"event": "order_created", "order_id": 1}]}
+    kind, data = encode_frame(payload, "json")
+    assert kind == "text" and json.loads(data) == payload
+    kind, data = encode_frame(payload, "msgpack")
+    assert kind == "bytes" and msgpack.unpackb(data) == payload
+    assert len(data) < len(json.dumps(payload))
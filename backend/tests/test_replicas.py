@@ -0,0 +1,101 @@
+"""
+Read-replica routing with two SQLite databases standing in for a primary and
+its replica. User 1 is named after the database it lives in, so a read shows
+which one served it.
+"""
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import db as db_module, main
+from backend.models import Base, User
+
+
+def _database(path, name):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [
+            {"id": 1, "name": name, "email": "taken@example.com", "hashed_password": "x", "role": "owner"},
+        ])
+    return engine
+
+
+@pytest.fixture
+def replicated(tmp_path, monkeypatch):
+    primary = _database(tmp_path / "primary.db", "primary")
+    replica = _database(tmp_path / "replica.db", "replica")
+    replicas = [replica]
+    status = [{"url": "replica", "healthy": False, "lag_seconds": None, "checked_at": None, "error": None}]
+    monkeypatch.setattr(db_module, "engine", primary)
+    monkeypatch.setattr(db_module, "replica_engines", replicas)
+    monkeypatch.setattr(db_module, "replica_status", status)
+    monkeypatch.setattr(main, "replica_engines", replicas)
+    monkeypatch.setattr(main, "SessionLocal", sessionmaker(bind=primary, autoflush=False))
+    monkeypatch.setattr(main, "redis_available", False)
+    monkeypatch.setattr(main, "recent_writers", {})
+    db_module.check_replicas()
+    yield TestClient(main.app), status
+    primary.dispose()
+    replica.dispose()
+
+
+def _served_by(client, headers=None):
+    return client.get("/users/1", headers=headers or {}).json()["name"]
+
+
+def test_reads_go_to_a_healthy_replica(replicated):
+    client, status = replicated
+    assert status[0]["healthy"] and status[0]["lag_seconds"] == 0.0
+    assert _served_by(client) == "replica"
+
+def test_unhealthy_replica_falls_back_to_primary(replicated):
+    client, status = replicated
+    status[0]["healthy"] = False
+    assert _served_by(client) == "primary"
+
+def test_unreachable_replica_is_marked_unhealthy(replicated, tmp_path):
+    client, status = replicated
+    # The fixture's list, so teardown doesn't need to restore it
+    db_module.replica_engines[0] = create_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    db_module.check_replicas()
+    assert not status[0]["healthy"] and status[0]["error"]
+    assert _served_by(client) == "primary"
+
+def test_writer_reads_its_writes_from_primary(replicated):
+    client, _ = replicated
+    writer = {"Authorization": "Bearer writer"}
+    response = client.post("/signup/", json={"name": "n", "email": "new@example.com", "password": "secret1", "role": "owner"}, headers=writer)
+    assert response.status_code == 200
+    assert _served_by(client, writer) == "primary"
+    # Other clients keep reading from the replica
+    assert _served_by(client, {"Authorization": "Bearer other"}) == "replica"
+    # Stickiness runs out after READ_YOUR_WRITES_SECONDS
+    for key in main.recent_writers:
+        main.recent_writers[key] = 0
+    assert _served_by(client, writer) == "replica"
+
+def test_expired_writers_are_pruned_on_write(replicated):
+    client, _ = replicated
+    body = {"password": "secret1", "role": "owner"}
+    client.post("/signup/", json=dict(body, name="a", email="a@example.com"), headers={"Authorization": "Bearer a"})
+    for key in main.recent_writers:
+        main.recent_writers[key] = 0
+    client.post("/signup/", json=dict(body, name="b", email="b@example.com"), headers={"Authorization": "Bearer b"})
+    assert len(main.recent_writers) == 1
+    assert _served_by(client, {"Authorization": "Bearer b"}) == "primary"
+
+def test_failed_write_does_not_stick(replicated):
+    client, _ = replicated
+    writer = {"Authorization": "Bearer writer"}
+    response = client.post("/signup/", json={"name": "n", "email": "taken@example.com", "password": "secret1", "role": "owner"}, headers=writer)
+    assert response.status_code == 400
+    assert main.recent_writers == {}
+    assert _served_by(client, writer) == "replica"
+
+def test_writes_are_not_tracked_without_replicas(replicated, monkeypatch):
+    client, _ = replicated
+    monkeypatch.setattr(main, "replica_engines", [])
+    client.post("/signup/", json={"name": "n", "email": "new@example.com", "password": "secret1", "role": "owner"})
+    assert main.recent_writers == {}
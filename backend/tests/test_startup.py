@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+from sqlalchemy import create_engine, text
+
+from backend.migrations import migrate, LATEST_VERSION
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _import_app(env_overrides):
+    env = dict(os.environ, PYTHONPATH=ROOT, **env_overrides)
+    code = (
+        "import sys, backend.main\n"
+        "print('passlib' in sys.modules, 'redis' in sys.modules)\n"
+    )
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, cwd=ROOT)
+
+def test_import_survives_database_outage():
+    # Nothing listens on port 1, so any connection attempt at import would fail
+    result = _import_app({"DATABASE_URL": "postgresql://opspulse@127.0.0.1:1/opspulse"})
+    assert result.returncode == 0, result.stderr
+
+def test_import_does_not_load_crypto_or_redis():
+    result = _import_app({"DATABASE_URL": "sqlite:///:memory:"})
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ["False", "False"]
+
+def _ensure_schema(env):
+    code = (
+        "from backend import main, db\n"
+        "from backend.migrations import current_version\n"
+        "main.ensure_schema()\n"
+        "print(current_version(db.engine))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, cwd=ROOT)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+def test_startup_creates_schema_on_empty_database(tmp_path):
+    env = dict(os.environ, PYTHONPATH=ROOT, DATABASE_URL=f"sqlite:///{tmp_path / 'fresh.db'}")
+    env.pop("MIGRATE_ON_STARTUP", None)
+    assert _ensure_schema(env).split()[-1] == str(LATEST_VERSION)
+
+def test_startup_only_checks_schema_version(tmp_path):
+    path = tmp_path / "behind.db"
+    engine = create_engine(f"sqlite:///{path}")
+    migrate(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM schema_migrations WHERE version = :v"), {"v": LATEST_VERSION})
+    engine.dispose()
+    env = dict(os.environ, PYTHONPATH=ROOT, DATABASE_URL=f"sqlite:///{path}")
+    env.pop("MIGRATE_ON_STARTUP", None)
+    out = _ensure_schema(env)
+    assert "Run backend/migrate_db.py" in out
+    assert out.split()[-1] == str(LATEST_VERSION - 1)
@@ -21,7 +21,12 @@ export function connectOrdersWS(baseUrl, onMessage) {
   ws.onmessage = (event) => {
     try {
       const msg = JSON.parse(event.data);
-      onMessage?.(msg);
+      // Batched feeds (?batch_ms=...) wrap several events in one frame
+      if (msg.event === 'batch') {
+        msg.events.forEach((e) => onMessage?.(e));
+      } else {
+        onMessage?.(msg);
+      }
     } catch {
       // ignore bad payloads
     }
@@ -29,4 +34,18 @@ export function connectOrdersWS(baseUrl, onMessage) {
   return ws;
 }
 
-
+// Same feed as Server-Sent Events, for networks whose proxies break WebSockets.
+// EventSource reconnects on its own; call .close() to stop it.
+export function connectOrdersSSE(baseUrl, onMessage) {
+  const apiUrl = baseUrl || API_BASE_URL;
+  const sseUrl = apiUrl.startsWith('/') ? `${window.location.origin}${apiUrl}/sse/orders` : `${apiUrl}/sse/orders`;
+  const source = new EventSource(sseUrl);
+  source.onmessage = (event) => {
+    try {
+      onMessage?.(JSON.parse(event.data));
+    } catch {
+      // ignore bad payloads
+    }
+  };
+  return source;
+}
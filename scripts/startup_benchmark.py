@@ -0,0 +1,38 @@
+"""
+Measure how quickly a fresh worker can serve its first request.
+
+Run from the repository root: PYTHONPATH=. python scripts/startup_benchmark.py [runs]
+Each run starts a new interpreter, so nothing is shared between runs. Reports
+the time to import backend.main and the time until the lifespan startup has
+finished and GET / has answered.
+"""
+import json
+import statistics
+import subprocess
+import sys
+
+PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+from backend.main import app
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app) as client:
+    assert client.get("/").status_code == 200
+    t2 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "ready": t2 - t0}))
+"""
+
+
+def run_once():
+    out = subprocess.run([sys.executable, "-c", PROBE], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = [run_once() for _ in range(runs)]
+    for key in ("import", "ready"):
+        samples = [r[key] * 1000 for r in results]
+        print(f"{key:>6}: median {statistics.median(samples):7.1f} ms   "
+              f"min {min(samples):7.1f} ms   max {max(samples):7.1f} ms   ({runs} runs)")
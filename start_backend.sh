@@ -1,5 +1,7 @@
 #!/bin/bash
 # Startup script for Render - sets PYTHONPATH and starts the server
 export PYTHONPATH="${PYTHONPATH}:$(pwd)"
+# Apply schema migrations once, before any worker starts serving
+python backend/migrate_db.py || exit 1
 uvicorn backend.main:app --host 0.0.0.0 --port ${PORT:-8000}
 